@@ -9,7 +9,37 @@ def main():
     parser.add_argument('-d', '--debug', action='store_true', default=False, help='Run in debug mode')
     parser.add_argument('-l', '--live', action='store_true', default=False, help='Use host 0.0.0.0')
     parser.add_argument('-p', '--port', default=5000, help='Choose a port. Default is 5000')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='Run with the production server (waitress) instead of the dev server')
+    serve_parser.add_argument('--host', default='0.0.0.0', help='Default is 0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=5000, help='Default is 5000')
+    serve_parser.add_argument('--processes', type=int, default=1, help='Worker processes forked after the app is created. Default is 1')
+    serve_parser.add_argument('--threads', type=int, default=8, help='Threads per worker. Default is 8')
+    serve_parser.add_argument('--connection-limit', type=int, default=100, help='Open connections per worker. Default is 100')
+    serve_parser.add_argument('--keep-alive', type=int, default=120, help='Seconds an idle connection is kept open. Default is 120')
+    serve_parser.add_argument('--graceful-timeout', type=int, default=30, help='Seconds a stopping worker may take to finish its requests. Default is 30')
+    events_parser = subparsers.add_parser('events', help='Serve live update streams with aiohttp, see uhs12app/sse_server.py')
+    events_parser.add_argument('--host', default='0.0.0.0', help='Default is 0.0.0.0')
+    events_parser.add_argument('--port', type=int, default=5001, help='Default is 5001')
     args = parser.parse_args()
+
+    if args.command == 'serve':
+        from uhs12app.server import serve
+        serve(
+            app,
+            host=args.host,
+            port=args.port,
+            processes=args.processes,
+            threads=args.threads,
+            connection_limit=args.connection_limit,
+            keep_alive=args.keep_alive,
+            graceful_timeout=args.graceful_timeout,
+        )
+        return
+    if args.command == 'events':
+        from uhs12app.sse_server import serve_events
+        serve_events(app, host=args.host, port=args.port)
+        return
     hostip = '0.0.0.0' if args.live else None
 
     app.run(host=hostip, port=args.port, debug=args.debug)
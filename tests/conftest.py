@@ -0,0 +1,240 @@
+"""
+Fixtures for the route benchmarks, and apps on fresh databases for the other tests.
+
+A house is seeded into a SQLite database for each scale run. The small
+scale always runs; pick others with --scales (or UHS_BENCH_SCALES), e.g.
+
+    python -m pytest tests --scales small,large --bench-json results.json
+"""
+import datetime
+import json
+import os
+import platform
+import time
+import pytest
+from sqlalchemy import event
+from uhs12app import create_app, db, bcrypt
+from uhs12app.config import Config
+
+SCALES = {
+    "small": dict(members=10, former_members=5, tasks=20, logs=1000, posts=30, invites=3),
+    "medium": dict(members=50, former_members=50, tasks=40, logs=20000, posts=200, invites=10),
+    "large": dict(members=200, former_members=400, tasks=60, logs=100000, posts=1000, invites=40),
+}
+PASSWORD = "benchmark"
+INSERT_BATCH = 5000
+
+results = []
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("uhs12 benchmarks")
+    group.addoption(
+        "--scales",
+        default=os.environ.get("UHS_BENCH_SCALES", "small"),
+        help=f"Comma separated data scales to run, from {', '.join(SCALES)}. Default is small",
+    )
+    group.addoption(
+        "--bench-json",
+        default=os.environ.get("UHS_BENCH_JSON"),
+        help="Write the timings and query counts to this file",
+    )
+    group.addoption("--bench-runs", type=int, default=5, help="Timed requests per read route. Default is 5")
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        scales = [name.strip() for name in metafunc.config.getoption("scales").split(",") if name.strip()]
+        unknown = set(scales) - set(SCALES)
+        if unknown:
+            raise pytest.UsageError(f"Unknown scales {', '.join(sorted(unknown))}")
+        metafunc.parametrize("scale", scales, scope="session")
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption("bench_json")
+    if not path or not results:
+        return
+    with open(path, "w") as out:
+        json.dump(
+            {
+                "created": datetime.datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "scales": {name: SCALES[name] for name in sorted({result["scale"] for result in results})},
+                "results": results,
+            },
+            out,
+            indent=2,
+        )
+
+
+class BenchConfig(Config):
+    LOAD_SETTINGS = False
+    SECRET_KEY = "benchmark"
+    WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    MAIL_SUPPRESS_SEND = True
+    # Measure the real work of each route, not the page cache
+    RESPONSE_CACHE_ENABLED = False
+
+
+def seed(scale):
+    """One house with members, past members, tasks, completed tasks, posts and invites"""
+    from uhs12app.models import (
+        User, Membership, House, Invite, Task, TaskLog, ShamePost, TaskRequest, TaskClaim
+    )
+    now = datetime.datetime.utcnow()
+    password = bcrypt.generate_password_hash(PASSWORD).decode("utf-8")
+    house = House(name="bench", adminId=1)
+    db.session.add(house)
+    db.session.flush()
+    people = scale["members"] + scale["former_members"] + scale["invites"]
+    users = [
+        dict(username=f"user{i}", email=f"user{i}@example.com", password=password, activeHouseId=house.id)
+        for i in range(people)
+    ]
+    db.session.execute(User.__table__.insert(), users)
+    user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+    members = user_ids[: scale["members"]]
+    former = user_ids[scale["members"] : scale["members"] + scale["former_members"]]
+    invited = user_ids[scale["members"] + scale["former_members"] :]
+    house.adminId = members[0]
+    db.session.execute(
+        Membership.__table__.insert(),
+        [dict(houseId=house.id, idUser=user_id, isExpired=False) for user_id in members]
+        + [dict(houseId=house.id, idUser=user_id, isExpired=True) for user_id in former],
+    )
+    db.session.execute(
+        Invite.__table__.insert(), [dict(houseId=house.id, idUserInvited=user_id) for user_id in invited]
+    )
+    db.session.execute(
+        Task.__table__.insert(),
+        [
+            dict(houseId=house.id, name=f"task{i}", description="Benchmark task", value=i % 10 + 1,
+                 coolOffPeriod=i % 3, coolOffValue=1)
+            for i in range(scale["tasks"])
+        ],
+    )
+    task_ids = [task_id for task_id, in db.session.query(Task.id).order_by(Task.id)]
+    # Spread over the last two years, newest first
+    spacing = datetime.timedelta(days=730) / scale["logs"]
+    rows = []
+    for i in range(scale["logs"]):
+        rows.append(
+            dict(houseId=house.id, taskId=task_ids[i % len(task_ids)], idUser=members[i % len(members)],
+                 value=i % 10 + 1, coolOff=False, dateCreated=now - spacing * i)
+        )
+        if len(rows) == INSERT_BATCH:
+            db.session.execute(TaskLog.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(TaskLog.__table__.insert(), rows)
+    for task_id in task_ids[: len(task_ids) // 2]:
+        task = Task.query.get(task_id)
+        task.refreshLastCompleted()
+    # Some open requests and claims on the first tasks, the rest are left for the write routes
+    for i, task_id in enumerate(task_ids[:4]):
+        db.session.add(TaskRequest(houseId=house.id, taskId=task_id, userId=members[i % len(members)]))
+    for i, task_id in enumerate(task_ids[2:4]):
+        db.session.add(TaskClaim(houseId=house.id, taskId=task_id, userId=members[(i + 1) % len(members)]))
+    db.session.execute(
+        ShamePost.__table__.insert(),
+        [
+            dict(houseId=house.id, userId=members[i % len(members)], comment=f"Post {i}",
+                 postImage="default.jpg", status=ShamePost.STATUS_READY, dateCreated=now - spacing * i)
+            for i in range(scale["posts"])
+        ],
+    )
+    db.session.commit()
+    return dict(house_id=house.id, members=members, tasks=task_ids, invited=invited)
+
+
+def clear_caches():
+    """Caches are per process, and ids repeat across the test databases"""
+    from uhs12app.cache import page_cache
+    from uhs12app.templating import fragment_cache
+    from uhs12app.users.cache import user_cache
+    user_cache.clear()
+    page_cache.clear()
+    fragment_cache.clear()
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """make_app(**config) creates an app on a new, empty database"""
+    made = []
+
+    def make_app(**config):
+        class TestConfig(BenchConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path}/test{len(made)}.db"
+        for name, value in config.items():
+            setattr(TestConfig, name, value)
+        made.append(create_app(TestConfig, create_db=True))
+        return made[-1]
+
+    clear_caches()
+    yield make_app
+    clear_caches()
+
+
+@pytest.fixture(scope="session")
+def bench(scale, tmp_path_factory):
+    """The app, seeded for the scale, with a counter of the SQL statements run"""
+    class ScaleConfig(BenchConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path_factory.mktemp(scale)}/bench.db"
+
+    app = create_app(ScaleConfig, create_db=True)
+    clear_caches()
+    statements = [0]
+    with app.app_context():
+        seeded = seed(SCALES[scale])
+
+        def count(*args):
+            statements[0] += 1
+
+        event.listen(db.engine, "before_cursor_execute", count)
+    return dict(app=app, scale=scale, statements=statements, **seeded)
+
+
+@pytest.fixture(scope="session")
+def client(bench):
+    """Logged in as the house admin"""
+    client = bench["app"].test_client()
+    response = client.post("/login", data={"email": "user0@example.com", "password": PASSWORD})
+    assert response.status_code == 302, "Logging in failed"
+    # Load the user into the user cache, as it is for everything but a user's first request
+    client.get("/profile")
+    return client
+
+
+@pytest.fixture
+def measure(bench, client):
+    """
+    measure(route, method, url, runs, using, **kwargs) requests url `runs` times, with the
+    admin's client or the one given as `using`, and returns (last response, SQL statements
+    per request). The timings are kept for --bench-json
+    """
+    def measure(route, method, url, runs=1, using=None, **kwargs):
+        timings = []
+        counts = []
+        for _ in range(runs):
+            bench["statements"][0] = 0
+            start = time.perf_counter()
+            response = (using or client).open(url, method=method, **kwargs)
+            timings.append((time.perf_counter() - start) * 1000)
+            counts.append(bench["statements"][0])
+        timings.sort()
+        results.append(
+            dict(
+                scale=bench["scale"],
+                route=route,
+                method=method,
+                status=response.status_code,
+                queries=max(counts),
+                runs=runs,
+                median_ms=round(timings[len(timings) // 2], 3),
+                min_ms=round(timings[0], 3),
+            )
+        )
+        return response, max(counts)
+    return measure
@@ -0,0 +1,85 @@
+"""
+Task actions that must only happen once, however often they are sent.
+"""
+import pytest
+from conftest import PASSWORD, SCALES, seed
+from uhs12app import db
+from uhs12app.house.leaderboard import leaderboard
+from uhs12app.models import Membership, TaskClaim, TaskLog, TaskRequest
+
+
+@pytest.fixture
+def house(make_app):
+    app = make_app()
+    with app.app_context():
+        seeded = seed(dict(SCALES["small"], logs=10))
+    client = app.test_client()
+    client.post("/login", data={"email": "user0@example.com", "password": PASSWORD})
+    return dict(app=app, client=client, **seeded)
+
+
+def card(client, task_id):
+    return next(task for task in client.get("/api/v1/board").get_json()["tasks"] if task["id"] == task_id)
+
+
+def state(house, task_id):
+    """(log entries for the task, user0's points)"""
+    with house["app"].app_context():
+        entries = TaskLog.query.filter_by(taskId=task_id).count()
+        points = {user.id: pts for user, pts in leaderboard(db.session, house["house_id"]).items()}
+        return entries, points[house["members"][0]]
+
+
+def test_complete_twice(house):
+    """A double tap on Complete logs the task and awards its points once"""
+    task_id = house["tasks"][-1]
+    task = card(house["client"], task_id)
+    entries, points = state(house, task_id)
+    url = f"/taskcomplete?taskid={task_id}&seen={task['seen']}"
+    house["client"].get(url)
+    house["client"].get(url)
+    assert state(house, task_id) == (entries + 1, points + task["currentValue"])
+
+
+def test_complete_needs_seen(house):
+    task_id = house["tasks"][-1]
+    before = state(house, task_id)
+    response = house["client"].get(f"/taskcomplete?taskid={task_id}", follow_redirects=True)
+    assert b"out of date" in response.data
+    result = house["client"].post(
+        "/api/v1/tasks/batch", json={"actions": [{"action": "complete", "taskId": task_id}]}
+    ).get_json()["results"][0]
+    assert not result["ok"]
+    assert state(house, task_id) == before
+
+
+def test_batch_complete_twice(house):
+    task_id = house["tasks"][-2]
+    task = card(house["client"], task_id)
+    entries, points = state(house, task_id)
+    action = {"action": "complete", "taskId": task_id, "seen": task["seen"]}
+    results = house["client"].post("/api/v1/tasks/batch", json={"actions": [action, action]}).get_json()["results"]
+    assert [result["ok"] for result in results] == [True, False]
+    assert state(house, task_id) == (entries + 1, points + task["currentValue"])
+
+
+def test_left_house_while_cached(house):
+    """Another worker still has the user cached as in the house, writes check the membership itself"""
+    house["client"].get("/profile")
+    with house["app"].app_context():
+        Membership.query.filter_by(idUser=house["members"][0], houseId=house["house_id"]).update(
+            {Membership.isExpired: True}
+        )
+        db.session.commit()
+    task_id = house["tasks"][-1]
+    task = card(house["client"], task_id)
+    with house["app"].app_context():
+        claims = TaskClaim.query.count()
+        requests = TaskRequest.query.count()
+    house["client"].get(f"/taskclaim?taskid={task_id}")
+    house["client"].get(f"/taskrequest?taskid={task_id}")
+    house["client"].get(f"/taskcomplete?taskid={task_id}&seen={task['seen']}")
+    with house["app"].app_context():
+        assert TaskClaim.query.count() == claims
+        assert TaskRequest.query.count() == requests
+        assert TaskLog.query.filter_by(taskId=task_id).count() == 0
@@ -0,0 +1,81 @@
+"""
+Archiving the task log: totals stay exact and the log still reads end to end.
+"""
+import datetime
+import pytest
+from conftest import PASSWORD, SCALES, seed
+from uhs12app import db
+from uhs12app.archive import archive_cutoff, archive_tasklog
+from uhs12app.house.leaderboard import WINDOWS, leaderboard
+from uhs12app.models import PointsRollup, TaskLog, TaskLogArchive
+
+
+def totals(house_id):
+    return {window: {user.id: points for user, points in leaderboard(db.session, house_id, window).items()}
+            for window in WINDOWS}
+
+
+def read_log(client):
+    """Every entry from /api/v1/log, following the next cursors"""
+    entries = []
+    page = client.get("/api/v1/log").get_json()
+    entries.extend(page["entries"])
+    while page["next"]:
+        page = client.get("/api/v1/log", query_string={"after": page["next"]}).get_json()
+        entries.extend(page["entries"])
+    return entries
+
+
+@pytest.fixture
+def archived(make_app):
+    """A seeded house with everything before last month archived"""
+    app = make_app()
+    with app.app_context():
+        seeded = seed(SCALES["small"])
+        before = totals(seeded["house_id"])
+        moved = archive_tasklog(archive_cutoff(30), batch_size=100)
+    return dict(app=app, before=before, moved=moved, **seeded)
+
+
+def test_totals_unchanged(archived):
+    assert archived["moved"] > 0
+    with archived["app"].app_context():
+        assert TaskLog.query.count() + TaskLogArchive.query.count() == SCALES["small"]["logs"]
+        assert totals(archived["house_id"]) == archived["before"]
+
+
+def test_second_run_moves_nothing(archived):
+    with archived["app"].app_context():
+        rollups = db.session.query(db.func.sum(PointsRollup.points), db.func.sum(PointsRollup.entries)).one()
+        assert archive_tasklog(archive_cutoff(30), batch_size=100) == 0
+        assert db.session.query(db.func.sum(PointsRollup.points), db.func.sum(PointsRollup.entries)).one() == rollups
+        assert rollups[1] == archived["moved"]
+        assert totals(archived["house_id"]) == archived["before"]
+
+
+def test_log_reads_into_archive(archived):
+    client = archived["app"].test_client()
+    client.post("/login", data={"email": "user0@example.com", "password": PASSWORD})
+    entries = read_log(client)
+    ids = [entry["id"] for entry in entries]
+    assert len(ids) == len(set(ids)) == SCALES["small"]["logs"]
+    assert sum(entry["archived"] for entry in entries) == archived["moved"]
+    keys = [(entry["dateCreated"], entry["id"]) for entry in entries]
+    assert keys == sorted(keys, reverse=True)
+    # The html log pages through the same entries
+    page = client.get("/tasklog")
+    assert page.status_code == 200
+
+
+def test_archive_after_log_emptied(make_app):
+    """Ids aren't handed out again once every entry has been archived"""
+    app = make_app()
+    with app.app_context():
+        seeded = seed(dict(SCALES["small"], logs=30))
+        everything = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        assert archive_tasklog(everything) == 30
+        db.session.add(TaskLog(houseId=seeded["house_id"], taskId=seeded["tasks"][0], idUser=seeded["members"][0],
+                               value=1, dateCreated=datetime.datetime.utcnow()))
+        db.session.commit()
+        assert TaskLog.query.one().id > db.session.query(db.func.max(TaskLogArchive.id)).scalar()
+        assert archive_tasklog(everything) == 1
@@ -0,0 +1,148 @@
+"""
+Round trips through `flask export-data` and `flask import-data`: a seeded
+house exported from one database and imported into another that already has
+data, so every id changes and one of the users already exists.
+"""
+import datetime
+import io
+import pytest
+from conftest import PASSWORD, SCALES, seed
+from uhs12app import db
+from uhs12app.archive import archive_tasklog
+from uhs12app.datatools import export_rows, import_rows, read_csv, read_jsonl, write_csv, write_jsonl
+from uhs12app.models import (
+    User, House, Membership, Invite, Task, TaskLog, TaskLogArchive, ShamePost, TaskRequest, TaskClaim
+)
+
+SCALE = dict(SCALES["small"], logs=200, posts=5)
+
+
+def snapshot(house_name):
+    """The house's rows with ids replaced by emails and names, so databases can be compared"""
+    house = House.query.filter_by(name=house_name).one()
+    emails = dict(db.session.query(User.id, User.email))
+    tasks = dict(db.session.query(Task.id, Task.name))
+    houses = dict(db.session.query(House.id, House.name))
+    members = db.session.query(Membership.idUser).filter_by(houseId=house.id)
+    logs = [
+        (tasks[log.taskId], emails[log.idUser], log.value, log.coolOff, log.dateCreated)
+        for model in (TaskLog, TaskLogArchive)
+        for log in model.query.filter_by(houseId=house.id)
+    ]
+    return dict(
+        house=(house.name, emails[house.adminId], house.dateCreated),
+        users=sorted(
+            (user.email, user.password, houses.get(user.activeHouseId), user.dateCreated)
+            for user in User.query.filter(User.id.in_(members.subquery()))
+        ),
+        memberships=sorted((emails[m.idUser], m.isExpired) for m in Membership.query.filter_by(houseId=house.id)),
+        invites=sorted((emails[i.idUserInvited], i.isResponded) for i in Invite.query.filter_by(houseId=house.id)),
+        tasks=sorted(
+            (t.name, t.description, t.value, t.isOnceOff, t.isExpired, t.lastCompletedDate,
+             emails.get(t.lastCompletedPersonId))
+            for t in Task.query.filter_by(houseId=house.id)
+        ),
+        requests=sorted(
+            (tasks[r.taskId], emails[r.userId], r.isExpired, r.dateCreated)
+            for r in TaskRequest.query.filter_by(houseId=house.id)
+        ),
+        claims=sorted(
+            (tasks[c.taskId], emails[c.userId], c.isExpired, c.dateCreated)
+            for c in TaskClaim.query.filter_by(houseId=house.id)
+        ),
+        logs=sorted(logs),
+        posts=sorted(
+            (emails[p.userId], p.comment, p.status, p.imageHash, p.dateCreated)
+            for p in ShamePost.query.filter_by(houseId=house.id)
+        ),
+    )
+
+
+@pytest.fixture
+def source(make_app):
+    app = make_app()
+    with app.app_context():
+        seeded = seed(SCALE)
+        # Some entries in the archive, and a task whose last completion is someone's
+        archive_tasklog(datetime.datetime.utcnow() - datetime.timedelta(days=365))
+        task = Task.query.get(seeded["tasks"][0])
+        task.lastCompletedPersonId = seeded["members"][1]
+        db.session.commit()
+        expected = snapshot("bench")
+    return dict(app=app, expected=expected, **seeded)
+
+
+def existing_data():
+    """Another house, a user with one of the exported emails and one with an exported username"""
+    other = House(name="other", adminId=1)
+    db.session.add(other)
+    db.session.flush()
+    db.session.add_all([
+        User(username="someone", email="someone@example.com", password="!", activeHouseId=other.id),
+        User(username="already", email="user1@example.com", password="!", activeHouseId=other.id),
+        User(username="user2", email="different@example.com", password="!"),
+    ])
+    db.session.add(Task(houseId=other.id, name="other task", value=1))
+    db.session.commit()
+
+
+def check_import(source, target, counts):
+    with target.app_context():
+        imported = snapshot("bench")
+        expected = source["expected"]
+        # The user who was already there keeps their own password
+        existing = next(user for user in imported["users"] if user[0] == "user1@example.com")
+        assert existing[1] == "!"
+        imported["users"] = [user for user in imported["users"] if user[0] != "user1@example.com"]
+        expected["users"] = [user for user in expected["users"] if user[0] != "user1@example.com"]
+        assert imported == expected
+        assert counts["user (existing)"] == 1
+        assert User.query.filter_by(email="user1@example.com").count() == 1
+        assert User.query.filter(User.username.like("user2-%")).count() == 1
+        # Archived entries come back into the log, with no rollups to count them twice
+        assert counts["task_log"] == SCALE["logs"]
+        assert TaskLogArchive.query.count() == 0
+        # Nothing of the house that was already there changed
+        assert House.query.filter_by(name="other").one().adminId == 1
+        assert Task.query.filter_by(name="other task").count() == 1
+
+
+def test_jsonl_round_trip(source, make_app):
+    out = io.StringIO()
+    with source["app"].app_context():
+        written = write_jsonl(out, export_rows(source["house_id"], batch_size=50))
+    assert written == len(out.getvalue().splitlines())
+    target = make_app()
+    with target.app_context():
+        existing_data()
+        counts = import_rows(read_jsonl(io.StringIO(out.getvalue())), batch_size=50)
+    check_import(source, target, counts)
+
+
+def test_csv_round_trip(source, make_app, tmp_path):
+    directory = str(tmp_path / "export")
+    with source["app"].app_context():
+        write_csv(directory, export_rows(source["house_id"], batch_size=50))
+    target = make_app()
+    with target.app_context():
+        existing_data()
+        counts = import_rows(read_csv(directory), batch_size=50)
+    check_import(source, target, counts)
+
+
+def test_scrubbed_users_cant_log_in(source, make_app):
+    out = io.StringIO()
+    with source["app"].app_context():
+        write_jsonl(out, export_rows(source["house_id"], batch_size=50, scrub=True))
+    target = make_app()
+    with target.app_context():
+        # someone@example.com has "!", as scrubbed exports used to write
+        existing_data()
+        import_rows(read_jsonl(io.StringIO(out.getvalue())), batch_size=50)
+        scrubbed = User.query.filter(User.email.like("%@example.invalid")).first().email
+    client = target.test_client()
+    for email in (scrubbed, "someone@example.com"):
+        for password in (PASSWORD, "!"):
+            response = client.post("/login", data={"email": email, "password": password})
+            assert response.status_code == 200
+            assert b"Bad login" in response.data
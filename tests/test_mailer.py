@@ -0,0 +1,154 @@
+"""
+The outbox worker against a stand-in SMTP server running in this process.
+"""
+import datetime
+import socketserver
+import threading
+import pytest
+from uhs12app import db
+from uhs12app.mailer import queue_mail, send_pending
+from uhs12app.models import OutboxMail
+
+SENDER = "uhs12@example.com"
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """
+    Just enough SMTP for smtplib. Keeps the messages it accepts and counts
+    connections. Refuses recipients at REJECT_DOMAIN.
+    """
+    REJECT_DOMAIN = "@reject.example.com"
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 stub ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode("ascii").rstrip("\r\n")
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.reply("250 stub")
+            elif command == "HELO":
+                self.reply("250 stub")
+            elif command == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                if self.server.REJECT_DOMAIN in line:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(line.split(":", 1)[1].strip(" <>"))
+                    self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                body = []
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b".\r\n", b".\n", b""):
+                        break
+                    body.append(data)
+                self.server.messages.append((recipients, b"".join(body).decode("utf-8", "replace")))
+                self.reply("250 OK queued")
+            elif command == "RSET":
+                recipients = []
+                self.reply("250 OK")
+            elif command == "NOOP":
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Not implemented")
+
+
+@pytest.fixture
+def smtp():
+    server = SMTPStub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app(make_app, smtp):
+    app = make_app(
+        MAIL_SERVER="127.0.0.1",
+        MAIL_PORT=smtp.port,
+        MAIL_USE_TLS=False,
+        MAIL_SUPPRESS_SEND=False,
+        MAIL_MAX_ATTEMPTS=3,
+        MAIL_RETRY_BASE=30,
+    )
+    with app.app_context():
+        yield app
+
+
+def queue(*recipients):
+    queued = [queue_mail(f"Message {i}", SENDER, [recipient], f"Body {i}") for i, recipient in enumerate(recipients)]
+    db.session.commit()
+    return queued
+
+
+def test_batch_over_one_connection(app, smtp):
+    queue("a@example.com", "b@example.com", "c@example.com")
+    assert send_pending() == (3, 0)
+    assert smtp.connections == 1
+    assert [recipients for recipients, _ in smtp.messages] == [["a@example.com"], ["b@example.com"], ["c@example.com"]]
+    assert all("Subject: Message" in message for _, message in smtp.messages)
+    assert OutboxMail.query.filter_by(status=OutboxMail.STATUS_SENT).count() == 3
+    assert send_pending() == (0, 0)
+
+
+def test_failure_backs_off(app, smtp):
+    outgoing, = queue("nobody" + SMTPStub.REJECT_DOMAIN)
+    now = datetime.datetime.utcnow()
+    assert send_pending(now=now) == (0, 1)
+    assert outgoing.status == OutboxMail.STATUS_PENDING
+    assert outgoing.attempts == 1
+    assert outgoing.nextAttemptDate == now + datetime.timedelta(seconds=30)
+    assert outgoing.lastError
+    # Not due again until the backoff is over, then twice as long
+    assert send_pending(now=now + datetime.timedelta(seconds=29)) == (0, 0)
+    later = now + datetime.timedelta(seconds=30)
+    assert send_pending(now=later) == (0, 1)
+    assert outgoing.nextAttemptDate == later + datetime.timedelta(seconds=60)
+
+
+def test_failure_stops_the_batch(app, smtp):
+    """A refused message leaves the rest of the batch for the next run, on a fresh connection"""
+    queue("nobody" + SMTPStub.REJECT_DOMAIN, "a@example.com")
+    assert send_pending() == (0, 1)
+    assert send_pending() == (1, 0)
+    assert smtp.connections == 2
+
+
+def test_gives_up_after_max_attempts(app, smtp):
+    outgoing, = queue("nobody" + SMTPStub.REJECT_DOMAIN)
+    now = datetime.datetime.utcnow()
+    for attempt in range(3):
+        assert send_pending(now=now) == (0, 1)
+        now += datetime.timedelta(days=1)
+    assert outgoing.status == OutboxMail.STATUS_FAILED
+    assert outgoing.attempts == 3
+    assert send_pending(now=now) == (0, 0)
+    assert smtp.messages == []
@@ -0,0 +1,177 @@
+"""
+Time every route and hold it to a budget of SQL statements per request.
+
+The budgets don't depend on the scale: a route that needs more statements
+as the house grows (one query per member, per task, per post...) fails at
+the larger scales even when it passes at small.
+
+Routes that change what the others read (setactive, leavehouse) come last,
+and leavehouse is measured for a member other than the admin the rest use.
+"""
+import pytest
+from conftest import PASSWORD
+
+# route name, url, most SQL statements per request
+READ_ROUTES = [
+    ("tasks.home", "/home", 3),
+    ("tasks.tasklog", "/tasklog", 2),
+    ("house.myhouse", "/myhouse", 3),
+    ("house.myhouse week", "/myhouse?window=week", 3),
+    ("main.wallofshame", "/wallofshame", 1),
+    ("main.wallofshame_feed", "/wallofshame/feed", 1),
+    ("users.profile", "/profile", 2),
+    ("tasks.newtask", "/newtask", 0),
+    ("api.board", "/api/v1/board", 3),
+    ("api.leaderboard", "/api/v1/leaderboard", 1),
+    ("api.leaderboard month", "/api/v1/leaderboard?window=month", 1),
+    ("api.log", "/api/v1/log", 2),
+    # The admin already has a house, allowextra shows the forms anyway
+    ("house.create", "/create?allowextra=1", 1),
+    ("house.join", "/join?allowextra=1", 1),
+    ("metrics.show_metrics", "/metrics", 0),
+]
+
+# Routes known to go over budget, until they're fixed
+KNOWN_ISSUES = {}
+
+
+def route_params(routes):
+    return [pytest.param(*route, id=route[0], marks=KNOWN_ISSUES.get(route[0], ())) for route in routes]
+
+
+@pytest.mark.parametrize("route, url, budget", route_params(READ_ROUTES))
+def test_read_route(measure, bench, route, url, budget, pytestconfig):
+    # One request first, so the timed ones aren't paying for template compiles
+    measure(route + " (cold)", "GET", url)
+    response, queries = measure(route, "GET", url, runs=pytestconfig.getoption("bench_runs"))
+    assert response.status_code == 200
+    assert queries <= budget, f"{route} ran {queries} SQL statements, the budget is {budget}"
+
+
+def test_tasklog_deep_page(measure, client):
+    """Pages far back in the log cost the same as the first, one query for recent entries and one for the archive"""
+    cursor = client.get("/api/v1/log").get_json()["next"]
+    for _ in range(20):
+        cursor = client.get("/api/v1/log", query_string={"after": cursor}).get_json()["next"] or cursor
+    response, queries = measure("tasks.tasklog page 20", "GET", f"/tasklog?after={cursor}", runs=3)
+    assert response.status_code == 200
+    assert queries <= 2
+
+
+# Pages for visitors who aren't logged in: route name, url, most SQL statements per request
+GUEST_ROUTES = [
+    ("users.login", "/login", 0),
+    ("users.signup", "/signup", 0),
+    ("users.reset_request", "/reset_password", 0),
+]
+
+
+def logged_in(app, email):
+    """A client logged in as the user, who is in the user cache like the admin"""
+    client = app.test_client()
+    response = client.post("/login", data={"email": email, "password": PASSWORD})
+    assert response.status_code == 302, "Logging in failed"
+    client.get("/profile")
+    return client
+
+
+@pytest.mark.parametrize("route, url, budget", route_params(GUEST_ROUTES))
+def test_guest_route(measure, bench, route, url, budget):
+    guest = bench["app"].test_client()
+    measure(route + " (cold)", "GET", url, using=guest)
+    response, queries = measure(route, "GET", url, using=guest)
+    assert response.status_code == 200
+    assert queries <= budget, f"{route} ran {queries} SQL statements, the budget is {budget}"
+
+
+def test_login(measure, bench):
+    """Finding the user and checking the password, the hash is already at the configured cost"""
+    response, queries = measure(
+        "users.login POST", "POST", "/login", using=bench["app"].test_client(),
+        data={"email": "user1@example.com", "password": PASSWORD},
+    )
+    assert response.status_code == 302
+    assert queries <= 1
+
+
+def test_asset(measure, bench):
+    from uhs12app.assets.routes import asset_url
+    with bench["app"].test_request_context():
+        url = asset_url("main.css")
+    assert url.startswith("/assets/")
+    response, queries = measure("assets.asset", "GET", url)
+    assert response.status_code == 200
+    assert queries == 0
+
+
+# route name, url for the task id, most SQL statements per request
+WRITE_ROUTES = [
+    ("tasks.taskrequest", "/taskrequest?taskid={}", 4),
+    ("tasks.taskclaim", "/taskclaim?taskid={}", 4),
+    # Only the first half of the seeded tasks have a last completion date, so these are seen as never
+    ("tasks.taskcomplete", "/taskcomplete?taskid={}&seen=never", 5),
+]
+
+
+@pytest.mark.parametrize("route, url, budget", route_params(WRITE_ROUTES))
+def test_write_route(measure, bench, route, url, budget):
+    # The seeded requests and claims are on the first few tasks, use the last ones
+    task_id = bench["tasks"][-1 - [name for name, _, _ in WRITE_ROUTES].index(route)]
+    response, queries = measure(route, "GET", url.format(task_id))
+    assert response.status_code == 302
+    assert queries <= budget, f"{route} ran {queries} SQL statements, the budget is {budget}"
+
+
+def test_taskdelete(measure, client):
+    newest = client.get("/api/v1/log").get_json()["entries"][0]
+    response, queries = measure("tasks.taskdelete", "GET", f"/taskdelete?taskid={newest['id']}")
+    assert response.status_code == 302
+    assert queries <= 4
+
+
+def test_batch(measure, bench):
+    """A batch costs about what its actions cost one at a time, in one transaction"""
+    task_ids = bench["tasks"][-8:-4]
+    actions = [{"action": "complete", "taskId": task_id, "seen": "never"} for task_id in task_ids]
+    response, queries = measure("api.batch 4 completes", "POST", "/api/v1/tasks/batch", json={"actions": actions})
+    assert response.status_code == 200
+    assert all(result["ok"] for result in response.get_json()["results"])
+    assert queries <= 4 * 5
+
+
+def test_invite_reply(measure, bench, client):
+    """Answering a join request costs the same however many are waiting"""
+    from uhs12app.models import Invite
+    with bench["app"].app_context():
+        invite_id = Invite.query.filter_by(idUserInvited=bench["invited"][0]).first().id
+    response, queries = measure(
+        "house.replyinvite", "POST", f"/invite/{invite_id}/reply", data={"submitAccept": "accept"}
+    )
+    assert response.status_code == 302
+    assert queries <= 5
+    again = client.post(f"/invite/{invite_id}/reply", data={"submitDecline": "decline"}, follow_redirects=True)
+    assert b"already been answered" in again.data
+
+
+def test_setactive(measure, bench, client):
+    """The admin only has the one house, so it's set active again"""
+    response, queries = measure("users.setactive", "GET", f"/setactive?houseid={bench['house_id']}")
+    assert response.status_code == 302
+    assert queries <= 1
+    # Back into the user cache for whatever runs next
+    client.get("/profile")
+
+
+def test_leavehouse(measure, bench):
+    """The last member leaves their only house, and lands on whathouse"""
+    leaving = logged_in(bench["app"], "user{}@example.com".format(len(bench["members"]) - 1))
+    response, queries = measure(
+        "house.leavehouse", "GET", f"/leavehouse?houseid={bench['house_id']}", using=leaving
+    )
+    assert response.status_code == 302
+    assert response.location.endswith("/whathouse")
+    assert queries <= 5
+    # Leaving dropped them from the user cache, so this loads them again
+    response, queries = measure("house.whathouse", "GET", "/whathouse", using=leaving)
+    assert response.status_code == 200
+    assert queries <= 3
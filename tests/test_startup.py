@@ -0,0 +1,70 @@
+"""
+What starting a worker costs: the modules create_app imports and the time it takes.
+
+Each test starts a fresh interpreter with python -X importtime, so nothing
+imported by the other tests counts. See the slowest imports with
+
+    python -m pytest tests/test_startup.py -s
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed for uploads, the SSE sidecar or the data commands, so loaded when they're used
+LAZY_MODULES = ("PIL", "multiprocessing", "concurrent.futures.process", "aiohttp", "csv", "gzip")
+# Importing the app and calling create_app, in milliseconds
+STARTUP_BUDGET = 2000
+
+STARTUP = """
+import time
+start = time.perf_counter()
+from uhs12app import create_app
+from uhs12app.config import Config
+
+class StartupConfig(Config):
+    LOAD_SETTINGS = False
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SECRET_KEY = "startup"
+
+create_app(StartupConfig)
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def start_app():
+    """(milliseconds, {module: (self us, cumulative us)}) for one create_app in a new interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return float(result.stdout.strip().splitlines()[-1]), modules
+
+
+def slowest(modules, count=10):
+    ranked = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:count]
+    return "\n".join(f"{us / 1000:8.1f}ms  {name}" for name, (us, _) in ranked)
+
+
+def test_lazy_imports():
+    _, modules = start_app()
+    loaded = [name for name in LAZY_MODULES if name in modules]
+    assert not loaded, f"create_app imported {', '.join(loaded)}"
+
+
+def test_startup_time():
+    milliseconds, modules = start_app()
+    print(f"\ncreate_app took {milliseconds:.0f}ms, slowest imports:\n{slowest(modules)}")
+    assert milliseconds <= STARTUP_BUDGET, f"Startup took {milliseconds:.0f}ms\n{slowest(modules)}"
@@ -3,7 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
-from uhs12app.config import Config
+from uhs12app.config import Config, load_settings
 
 
 db = SQLAlchemy()
@@ -16,27 +16,51 @@ mail = Mail()
 def create_app(config_class=Config, create_db=False):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    if config_class.LOAD_SETTINGS:
+        app.config.from_mapping(load_settings())
 
+    from uhs12app.engine import apply_engine_options, init_engine
+    apply_engine_options(app)
     db.init_app(app)
+    init_engine(app, db)
+    from uhs12app.events import init_events
+    init_events(db)
+    from uhs12app.metrics.registry import init_metrics
+    init_metrics(app, db)
     bcrypt.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
+    from uhs12app.templating import init_templating
+    init_templating(app)
 
     from uhs12app.users.routes import users
     from uhs12app.tasks.routes import tasks
     from uhs12app.house.routes import house
     from uhs12app.main.routes import main
     from uhs12app.errors.handlers import errors
+    from uhs12app.api.routes import api
+    from uhs12app.metrics.routes import metrics
+    from uhs12app.assets.routes import assets
     app.register_blueprint(users)
     app.register_blueprint(tasks)
     app.register_blueprint(house)
     app.register_blueprint(main)
     app.register_blueprint(errors)
+    app.register_blueprint(api)
+    app.register_blueprint(metrics)
+    app.register_blueprint(assets)
 
+    from uhs12app.cache import page_cache
+    page_cache.maxsize = app.config["RESPONSE_CACHE_SIZE"]
+
+    from uhs12app.commands import register_commands
+    register_commands(app)
 
     if create_db:
-        print("Creating db at: ", config_class.SQLALCHEMY_DATABASE_URI)
+        print("Creating db at: ", app.config["SQLALCHEMY_DATABASE_URI"])
         with app.app_context():
+            from uhs12app import migrations
             db.create_all()
+            migrations.upgrade()
 
     return app
@@ -0,0 +1,168 @@
+"""
+Versioned JSON api, for clients that don't want to parse the html pages.
+Logged in with the same session cookie as the site.
+
+    GET  /api/v1/board                       the task board
+    GET  /api/v1/leaderboard?window=week     points per member, see house/leaderboard.py
+    GET  /api/v1/log?after=<cursor>          completed tasks, newest first, 20 at a time
+    GET  /api/v1/events                      server-sent events for the house, see events.py
+    POST /api/v1/tasks/batch                 complete, claim or request tasks
+
+A batch looks like
+    {"atomic": false, "actions": [{"action": "complete", "taskId": 3, "requestId": 7, "claimId": null,
+                                   "seen": "2019-08-01T10:00:00.123456"}, ...]}
+and is applied in one transaction. Completions need seen, the card's seen from
+/board (its lastCompletedDate, or "never"), and are refused if the task was
+completed since. The response has a result per action,
+    {"results": [{"index": 0, "ok": true, "id": 12}, {"index": 1, "ok": false, "error": "..."}]}
+where id is the new log entry, request or claim. With "atomic": true nothing
+is applied if any action fails.
+"""
+from functools import wraps
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from flask_login import current_user
+from uhs12app import db
+from uhs12app.tasks.board import TaskBoardInfo
+from uhs12app.tasks.actions import ActionError, parse_seen, request_task, claim_task, complete_task
+from uhs12app.house.leaderboard import leaderboard as house_leaderboard, WINDOWS, WINDOW_ALL
+from uhs12app.archive import log_page
+from uhs12app.events import broker, stream_events
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_BATCH = 50
+
+
+def error(message, status):
+    return jsonify(error=message), status
+
+
+def house_required(view):
+    """Like @login_required, but answers with json errors rather than redirects"""
+    @wraps(view)
+    def checked_view(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return error("Not logged in", 401)
+        if not current_user.activeHouseId:
+            return error("You are not in a house", 409)
+        return view(*args, **kwargs)
+    return checked_view
+
+
+@api.route("/board")
+@house_required
+def board():
+    task_info = TaskBoardInfo(current_user.activeHouseId, current_user.id)
+    return jsonify(tasks=[card.as_dict() for card in task_info.allTasks])
+
+
+@api.route("/leaderboard")
+@house_required
+def leaderboard():
+    window = request.args.get("window", WINDOW_ALL)
+    if window not in WINDOWS:
+        return error(f"window must be one of {', '.join(WINDOWS)}", 400)
+    points = house_leaderboard(db.session, current_user.activeHouseId, window)
+    return jsonify(
+        window=window,
+        points=[{"userId": user.id, "username": user.username, "points": pts} for user, pts in points.items()],
+    )
+
+
+@api.route("/log")
+@house_required
+def log():
+    page = log_page(current_user.activeHouseId, after=request.args.get("after"), before=request.args.get("before"))
+    entries = [
+        {
+            "id": entry.id,
+            "taskId": entry.taskId,
+            "taskName": entry.task.name,
+            "userId": entry.idUser,
+            "username": entry.user.username,
+            "value": entry.value,
+            "coolOff": entry.coolOff,
+            "dateCreated": entry.dateCreated.isoformat(),
+            "archived": entry.isArchived,
+        }
+        for entry in page.items
+    ]
+    return jsonify(entries=entries, next=page.next_cursor, prev=page.prev_cursor)
+
+
+def apply_action(item):
+    """Apply one batch item, returning the id of what it created"""
+    if not isinstance(item, dict):
+        raise ActionError("Each action must be an object")
+    try:
+        task_id = int(item["taskId"])
+        request_id = int(item["requestId"]) if item.get("requestId") else None
+        claim_id = int(item["claimId"]) if item.get("claimId") else None
+    except (KeyError, TypeError, ValueError):
+        raise ActionError("taskId is required, and ids must be integers")
+    action = item.get("action")
+    if action == "complete":
+        seen = parse_seen(item.get("seen"))
+        _, created = complete_task(current_user, task_id, seen, request_id=request_id, claim_id=claim_id)
+    elif action == "claim":
+        _, created = claim_task(current_user, task_id)
+    elif action == "request":
+        _, created = request_task(current_user, task_id)
+    else:
+        raise ActionError("action must be complete, claim or request")
+    return created.id
+
+
+@api.route("/tasks/batch", methods=["POST"])
+@house_required
+def batch():
+    # Only json, which a cross site form can't send, so no csrf token is needed
+    if not request.is_json:
+        return error("Expected a json body", 415)
+    body = request.get_json(silent=True)
+    actions = body.get("actions") if isinstance(body, dict) else None
+    if not isinstance(actions, list) or not actions:
+        return error("Expected a list of actions", 400)
+    if len(actions) > MAX_BATCH:
+        return error(f"At most {MAX_BATCH} actions per batch", 400)
+    atomic = bool(body.get("atomic"))
+    results = []
+    for index, item in enumerate(actions):
+        try:
+            results.append({"index": index, "ok": True, "id": apply_action(item)})
+        except ActionError as action_error:
+            results.append({"index": index, "ok": False, "error": str(action_error)})
+    applied = not (atomic and not all(result["ok"] for result in results))
+    if applied:
+        db.session.commit()
+    else:
+        db.session.rollback()
+        # Nothing was created, so the ids mean nothing
+        for result in results:
+            result.pop("id", None)
+    return jsonify(applied=applied, results=results), 200 if applied else 409
+
+
+@api.route("/events")
+@house_required
+def events():
+    config = current_app.config
+    if broker.stream_count() >= config["SSE_MAX_STREAMS"]:
+        response, status = error("Too many open streams, try again soon", 503)
+        response.headers["Retry-After"] = "10"
+        return response, status
+    house_id = current_user.activeHouseId
+    # The stream reads versions through connections of its own. Give back the
+    # request's, or it sits idle in a transaction for the whole stream
+    db.session.remove()
+    stream = stream_events(
+        house_id,
+        config["SSE_POLL_INTERVAL"],
+        config["SSE_STREAM_SECONDS"],
+        last_seen=request.headers.get("Last-Event-ID"),
+    )
+    response = Response(stream_with_context(stream), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop nginx buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
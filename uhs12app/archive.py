@@ -0,0 +1,99 @@
+"""
+Moving old TaskLog entries to TaskLogArchive, so TaskLog and every scan
+over it stays the size of recent activity.
+
+Before entries are moved, their points are added to PointsRollup, one row
+per house, user and month, so all time totals stay exact: the leaderboard
+adds the rollups to what is still in TaskLog. Only whole months are moved,
+and never the current or previous month, so the week and month windows
+are always answered from TaskLog alone.
+
+Each batch is copied, rolled up and deleted in one transaction, so an
+interrupted run leaves nothing counted twice and can simply be run again.
+"""
+import datetime
+from collections import Counter
+from sqlalchemy.orm import joinedload
+from uhs12app import db
+from uhs12app.cache import bump_house_version
+from uhs12app.models import TaskLog, TaskLogArchive, PointsRollup
+from uhs12app.pagination import KeysetPage
+
+
+def month_start(date):
+    return datetime.datetime(date.year, date.month, 1)
+
+
+def archive_cutoff(days, now=None):
+    """Entries before this are archived: the start of the month `days` ago, at the latest last month's start"""
+    now = now or datetime.datetime.utcnow()
+    latest = month_start(month_start(now) - datetime.timedelta(days=1))
+    return min(month_start(now - datetime.timedelta(days=days)), latest)
+
+
+def add_rollups(rows):
+    """Add the (houseId, idUser, dateCreated, value) rows' points to their months"""
+    points = Counter()
+    entries = Counter()
+    for house_id, user_id, date, value in rows:
+        key = (house_id, user_id, month_start(date))
+        points[key] += value
+        entries[key] += 1
+    for key, total in points.items():
+        house_id, user_id, period = key
+        updated = PointsRollup.query.filter_by(houseId=house_id, idUser=user_id, periodStart=period).update(
+            {PointsRollup.points: PointsRollup.points + total, PointsRollup.entries: PointsRollup.entries + entries[key]},
+            synchronize_session=False,
+        )
+        if not updated:
+            db.session.add(
+                PointsRollup(houseId=house_id, idUser=user_id, periodStart=period, points=total, entries=entries[key])
+            )
+
+
+def archive_batch(cutoff, batch_size=1000):
+    """Move up to batch_size entries from before cutoff. Returns how many were moved"""
+    rows = (
+        db.session.query(TaskLog.id, TaskLog.houseId, TaskLog.idUser, TaskLog.dateCreated, TaskLog.value)
+        .filter(TaskLog.dateCreated < cutoff)
+        # Walks the primary key and stops at batch_size, no index on dateCreated alone to sort by
+        .order_by(TaskLog.id)
+        .limit(batch_size)
+        .all()
+    )
+    if not rows:
+        return 0
+    ids = [row.id for row in rows]
+    columns = ("id", "houseId", "taskId", "idUser", "dateCreated", "value", "coolOff")
+    copy = db.session.query(*(getattr(TaskLog, column) for column in columns)).filter(TaskLog.id.in_(ids))
+    db.session.execute(TaskLogArchive.__table__.insert().from_select(columns, copy))
+    add_rollups((row.houseId, row.idUser, row.dateCreated, row.value) for row in rows)
+    TaskLog.query.filter(TaskLog.id.in_(ids)).delete(synchronize_session=False)
+    # Cached log pages still offer to delete the moved entries
+    for house_id in {row.houseId for row in rows}:
+        bump_house_version(house_id)
+    db.session.commit()
+    return len(rows)
+
+
+def archive_tasklog(cutoff, batch_size=1000):
+    """Move every entry from before cutoff, a batch at a time. Returns how many were moved"""
+    moved = 0
+    while True:
+        count = archive_batch(cutoff, batch_size)
+        moved += count
+        if count < batch_size:
+            return moved
+
+
+def log_page(house_id, per_page=20, after=None, before=None):
+    """A KeysetPage of the house's completed tasks, reading on into the archive for old pages"""
+    sources = [
+        (
+            model.query.filter_by(houseId=house_id).options(joinedload(model.task), joinedload(model.user)),
+            model.dateCreated,
+            model.id,
+        )
+        for model in (TaskLog, TaskLogArchive)
+    ]
+    return KeysetPage(*sources[0], per_page=per_page, after=after, before=before, also=sources[1:])
@@ -0,0 +1,139 @@
+"""
+Static files and uploaded pictures at content addressed urls.
+
+asset_url('main.css') in a template gives /assets/<digest>/main.css, where
+the digest is taken from the file's content. The url changes whenever the
+file does, so responses can be cached by browsers and proxies for a year
+without ever being checked again. A request for an old digest is redirected
+to the current one. Uploaded picture variants are already named after their
+content hash, so that is used as the digest instead of reading them again.
+
+Files are sent with send_file, which answers If-None-Match/If-Modified-Since
+with a 304 and Range requests with a 206. Browsers accepting gzip get a .gz
+next to the file instead, when there's an up to date one (see
+`flask compress-assets`). With ASSETS_ACCEL_REDIRECT set, e.g. to "/_static/"
+for an nginx internal location aliased to the static folder, the file is
+left to nginx through X-Accel-Redirect. USE_X_SENDFILE does the same for
+Apache and lighttpd.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from flask import Blueprint, abort, current_app, redirect, request, safe_join, send_file, url_for
+from uhs12app.main.images import SUB_DIR
+
+assets = Blueprint('assets', __name__)
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+DIGEST_LENGTH = 16
+# Types worth compressing, images are compressed already
+COMPRESSIBLE = (".css", ".js", ".svg", ".txt", ".json")
+# <content hash>_<variant>.jpg, see uhs12app/main/images.py
+UPLOAD_VARIANT = re.compile(rf"^{SUB_DIR}/([0-9a-f]{{32}})_[a-z]+\.jpg$")
+
+# path -> (mtime, size, digest)
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """Digest of the file's content, worked out again only when it changes"""
+    stat = os.stat(path)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    sha = hashlib.sha256()
+    with open(path, "rb") as data:
+        for chunk in iter(lambda: data.read(65536), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()[:DIGEST_LENGTH]
+    with _digests_lock:
+        _digests[path] = (stat.st_mtime, stat.st_size, digest)
+    return digest
+
+
+def digest_for(filename, path):
+    """Digest for the file's url, from its name for upload variants and its content for anything else"""
+    match = UPLOAD_VARIANT.match(filename)
+    if match:
+        return match.group(1)[:DIGEST_LENGTH]
+    return file_digest(path)
+
+
+def static_path(filename):
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+
+@assets.app_template_global()
+def asset_url(filename):
+    """Url of the static file, with its digest. Falls back to the plain static url for missing files"""
+    path = static_path(filename)
+    if path is None:
+        return url_for("static", filename=filename)
+    return url_for("assets.asset", digest=digest_for(filename, path), filename=filename)
+
+
+def precompressed(path):
+    """The .gz of the file, if the client takes gzip and the .gz is at least as new"""
+    if not path.endswith(COMPRESSIBLE) or "gzip" not in request.accept_encodings:
+        return None
+    gz_path = path + ".gz"
+    try:
+        if os.stat(gz_path).st_mtime >= os.stat(path).st_mtime:
+            return gz_path
+    except OSError:
+        pass
+    return None
+
+
+@assets.route("/assets/<digest>/<path:filename>")
+def asset(digest, filename):
+    path = static_path(filename)
+    if path is None:
+        abort(404)
+    current = digest_for(filename, path)
+    if digest != current:
+        return redirect(url_for("assets.asset", digest=current, filename=filename))
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    send_path = precompressed(path) or path
+    accel_prefix = current_app.config["ASSETS_ACCEL_REDIRECT"]
+    if accel_prefix:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = accel_prefix.rstrip("/") + "/" + os.path.relpath(
+            send_path, current_app.static_folder
+        ).replace(os.sep, "/")
+    else:
+        response = send_file(send_path, mimetype=mimetype, conditional=True)
+    if send_path != path:
+        response.headers["Content-Encoding"] = "gzip"
+    if path.endswith(COMPRESSIBLE):
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = IMMUTABLE
+    return response
+
+
+def compress_assets(static_folder):
+    """Write a .gz next to every compressible static file that lacks an up to date one. Returns how many were written"""
+    import gzip
+    import shutil
+
+    written = 0
+    for directory, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            if not filename.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(directory, filename)
+            gz_path = path + ".gz"
+            if os.path.exists(gz_path) and os.stat(gz_path).st_mtime >= os.stat(path).st_mtime:
+                continue
+            with open(path, "rb") as source, gzip.open(gz_path + ".tmp", "wb", compresslevel=9) as out:
+                shutil.copyfileobj(source, out)
+            os.replace(gz_path + ".tmp", gz_path)
+            written += 1
+    return written
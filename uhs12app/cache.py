@@ -0,0 +1,114 @@
+"""
+Cache of rendered pages, keyed on a per house version number.
+
+Each house has a version that every route changing what its pages show bumps
+with bump_house_version(), in the same transaction as the change. Pages
+wrapped with @cached_house_page are stored under the house's current version
+(plus the user, the url and a time bucket, for content that changes with the
+clock, like requests lapsing), so a page is only rendered again once something
+in the house has changed. The key is also sent as an ETag, so a browser that
+already has the page gets a 304 without it being rendered or sent at all.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from uhs12app import db
+
+
+class LRUCache(object):
+    """Thread safe dict that drops the least recently used entries past maxsize"""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+page_cache = LRUCache()
+
+
+def house_version(house_id):
+    from uhs12app.models import House
+    return db.session.query(House.version).filter_by(id=house_id).scalar()
+
+
+def bump_house_version(house_id):
+    """
+    Mark everything cached for the house as stale once the caller commits,
+    and tell the house's event streams it changed
+    """
+    from uhs12app.models import House
+    from uhs12app.events import house_event
+    if house_id:
+        House.query.filter_by(id=house_id).update({House.version: House.version + 1}, synchronize_session=False)
+        house_event(house_id)
+
+
+def cached_house_page(view):
+    """
+    Serve GETs of the view from the page cache, or with a 304, while the
+    user's house hasn't changed. Goes inside @login_required.
+    """
+    @wraps(view)
+    def cached_view(*args, **kwargs):
+        house_id = current_user.activeHouseId if current_user.is_authenticated else None
+        # Flashed messages are rendered into the page, so they can't come from the cache
+        if (
+            request.method != "GET"
+            or not house_id
+            or session.get("_flashes")
+            or not current_app.config["RESPONSE_CACHE_ENABLED"]
+        ):
+            return view(*args, **kwargs)
+        key = (
+            request.full_path,
+            house_id,
+            house_version(house_id),
+            current_user.id,
+            # Forms on the page carry the session's CSRF token
+            session.get("csrf_token"),
+            int(time.time() // current_app.config["RESPONSE_CACHE_BUCKET"]),
+        )
+        etag = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        if etag in request.if_none_match:
+            response = make_response("", 304)
+        else:
+            body = page_cache.get(key)
+            if body is None:
+                rv = view(*args, **kwargs)
+                # Only cache plain rendered pages, not redirects etc.
+                if not isinstance(rv, str):
+                    return rv
+                body = rv
+                page_cache.set(key, body)
+            response = make_response(body)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.vary.add("Cookie")
+        return response
+    return cached_view
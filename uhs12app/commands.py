@@ -0,0 +1,112 @@
+"""
+Flask CLI commands, run with e.g. `FLASK_APP=wsgi.py flask upgrade-db`
+"""
+import time
+import click
+from uhs12app import db
+
+
+def register_commands(app):
+
+    @app.cli.command("upgrade-db")
+    def upgrade_db():
+        """Create missing tables and apply schema migrations"""
+        from uhs12app import migrations
+        db.create_all()
+        applied = migrations.upgrade()
+        for version, description in applied:
+            click.echo(f"Applied migration {version}: {description}")
+        if not applied:
+            click.echo("Database is up to date")
+
+    @app.cli.command("compile-templates")
+    def compile_templates():
+        """Compile every template into the bytecode cache, e.g. after a deploy"""
+        from uhs12app.templating import compile_templates
+        if not app.jinja_env.bytecode_cache:
+            raise click.ClickException("JINJA_BYTECODE_CACHE is off")
+        click.echo(f"Compiled {compile_templates(app)} templates")
+
+    @app.cli.command("compress-assets")
+    def compress_assets():
+        """Write gzipped copies of the static css and js, served to browsers that accept them"""
+        from uhs12app.assets.routes import compress_assets
+        click.echo(f"Compressed {compress_assets(app.static_folder)} files")
+
+    @app.cli.command("expire-requests")
+    @click.option("--interval", type=int, default=0, help="Keep running, sweeping every INTERVAL seconds")
+    def expire_requests(interval):
+        """Flag lapsed task requests and claims as expired"""
+        from uhs12app.models import TaskRequest, TaskClaim
+        while True:
+            expired_requests = TaskRequest.expireStale(db.session)
+            expired_claims = TaskClaim.expireStale(db.session)
+            db.session.commit()
+            click.echo(f"Expired {expired_requests} requests and {expired_claims} claims")
+            if not interval:
+                break
+            time.sleep(interval)
+
+    @app.cli.command("send-mail")
+    @click.option("--interval", type=int, default=0, help="Keep running, checking the outbox every INTERVAL seconds")
+    @click.option("--batch", type=int, default=50, help="Most messages to send over one connection")
+    def send_mail(interval, batch):
+        """Send queued mail from the outbox"""
+        from uhs12app.mailer import send_pending
+        while True:
+            sent, failed = send_pending(batch)
+            if sent or failed or not interval:
+                click.echo(f"Sent {sent} messages, {failed} failed")
+            # Go again straight away if the batch was full
+            if sent + failed >= batch:
+                continue
+            if not interval:
+                break
+            time.sleep(interval)
+
+    @app.cli.command("archive-tasklog")
+    @click.option("--days", type=int, help="Archive entries older than this. Default is ARCHIVE_AFTER_DAYS")
+    @click.option("--batch", type=int, help="Entries moved per transaction. Default is ARCHIVE_BATCH")
+    def archive_tasklog(days, batch):
+        """Move old task log entries to the archive, rolling their points up by month"""
+        from uhs12app.archive import archive_cutoff, archive_tasklog
+        cutoff = archive_cutoff(days if days is not None else app.config["ARCHIVE_AFTER_DAYS"])
+        moved = archive_tasklog(cutoff, batch or app.config["ARCHIVE_BATCH"])
+        click.echo(f"Archived {moved} entries from before {cutoff:%Y-%m-%d}")
+
+    @app.cli.command("export-data")
+    @click.argument("output")
+    @click.option("--house", "house_id", type=int, help="Export just this house and its members")
+    @click.option("--format", "file_format", type=click.Choice(["jsonl", "csv"]), default="jsonl",
+                  help="jsonl writes OUTPUT as one file, - for stdout. csv writes a file per table into the OUTPUT directory")
+    @click.option("--batch", type=int, default=1000, help="Rows read at a time")
+    @click.option("--scrub", is_flag=True, help="Replace emails and passwords, for copies of live data")
+    def export_data(output, house_id, file_format, batch, scrub):
+        """Stream a house, or the whole database, out to JSONL or CSV"""
+        from uhs12app.datatools import export_rows, write_jsonl, write_csv
+        rows = export_rows(house_id, batch, scrub)
+        if file_format == "csv":
+            written = write_csv(output, rows)
+        else:
+            with click.open_file(output, "w") as out:
+                written = write_jsonl(out, rows)
+        click.echo(f"Exported {written} rows", err=True)
+
+    @app.cli.command("import-data")
+    @click.argument("source")
+    @click.option("--format", "file_format", type=click.Choice(["jsonl", "csv"]), default="jsonl",
+                  help="jsonl reads SOURCE as one file, - for stdin. csv reads the table files in the SOURCE directory")
+    @click.option("--batch", type=int, default=1000, help="Rows inserted and committed at a time")
+    def import_data(source, file_format, batch):
+        """Add exported data to the database, with new ids"""
+        from uhs12app.datatools import DataError, import_rows, read_jsonl, read_csv
+        try:
+            if file_format == "csv":
+                counts = import_rows(read_csv(source), batch)
+            else:
+                with click.open_file(source) as lines:
+                    counts = import_rows(read_jsonl(lines), batch)
+        except DataError as error:
+            raise click.ClickException(str(error))
+        for table, count in counts.items():
+            click.echo(f"{table}: {count}")
@@ -1,23 +1,157 @@
 import os
-import json 
+import json
+
+CONFIG_FILE = '/etc/uhsconfig.json'
+
+
+def as_bool(value):
+    return str(value).lower() in ("1", "true", "yes")
+
+
+# Settings that come from CONFIG_FILE or the environment: (config name, key, conversion)
+# Environment variables override the file.
+SETTINGS = (
+    ("SQLALCHEMY_DATABASE_URI", "UHS_SQLALCHEMY_DATABASE_URI", str),
+    ("SECRET_KEY", "UHS_SECRET_KEY", str),
+    # $env:EMAIL_UHS12CONTACT = ""
+    ("MAIL_USERNAME", "EMAIL_UHS12CONTACT", str),
+    ("MAIL_PASSWORD", "UHS12CONTACT_PASS", str),
+    # Can be pointed at a local stand-in SMTP server for testing, see uhs12app/mailer.py
+    ("MAIL_SERVER", "UHS_MAIL_SERVER", str),
+    ("MAIL_PORT", "UHS_MAIL_PORT", int),
+    ("MAIL_USE_TLS", "UHS_MAIL_USE_TLS", as_bool),
+    ("DB_ENGINE_PROFILE", "UHS_DB_ENGINE_PROFILE", str),
+    ("SSE_SIDECAR_URL", "UHS_SSE_SIDECAR_URL", str),
+    ("METRICS_TOKEN", "UHS_METRICS_TOKEN", str),
+    ("JINJA_BYTECODE_CACHE_DIR", "UHS_JINJA_BYTECODE_CACHE_DIR", str),
+    ("ASSETS_ACCEL_REDIRECT", "UHS_ASSETS_ACCEL_REDIRECT", str),
+    ("USE_X_SENDFILE", "UHS_USE_X_SENDFILE", as_bool),
+)
+
+# Database engine tuning, chosen with DB_ENGINE_PROFILE.
+# engine_options become SQLALCHEMY_ENGINE_OPTIONS, sqlite_pragmas are run on
+# every new SQLite connection (see uhs12app/engine.py)
+ENGINE_PROFILES = {
+    # Flask-SQLAlchemy's defaults, a new connection per request on SQLite
+    "default": {
+        "engine_options": {},
+        "sqlite_pragmas": {},
+    },
+    # SQLite in write ahead log mode, so readers don't block on a writer or the other way round.
+    # Connections are pooled so the pragmas are only run once per connection.
+    "sqlite-wal": {
+        "engine_options": {
+            "poolclass": "QueuePool",
+            "pool_size": 5,
+            "max_overflow": 10,
+            "connect_args": {"check_same_thread": False, "timeout": 15},
+        },
+        "sqlite_pragmas": {
+            "journal_mode": "WAL",
+            # Safe with WAL, only the last commits may be lost on power failure
+            "synchronous": "NORMAL",
+            "busy_timeout": 15000,
+            "temp_store": "MEMORY",
+            # Negative is KiB
+            "cache_size": -16000,
+        },
+    },
+    # A database server such as PostgreSQL or MySQL
+    "pooled-server": {
+        "engine_options": {
+            "pool_size": 10,
+            "max_overflow": 20,
+            "pool_timeout": 10,
+            "pool_recycle": 1800,
+            "pool_pre_ping": True,
+        },
+        "sqlite_pragmas": {},
+    },
+}
+
+
+def load_settings():
+    """
+    Read SETTINGS from CONFIG_FILE, if there is one, and the environment.
+    Called by create_app, so importing the app doesn't need the config file.
+    """
+    found = {}
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE) as config_file:
+            found.update(json.load(config_file))
+    found.update({key: os.environ[key] for _, key, _ in SETTINGS if key in os.environ})
+    return {name: convert(found[key]) for name, key, convert in SETTINGS if found.get(key) is not None}
 
 
 class Config(object):
 
+    # Settings from the config file or environment replace the defaults below.
+    # Set to False for configs that should be used exactly as written, e.g. in tests
+    LOAD_SETTINGS = True
+    SQLALCHEMY_DATABASE_URI = None
+    SECRET_KEY = None
+    MAIL_USERNAME = None
+    MAIL_PASSWORD = None
+
     MAIL_SERVER = 'smtp.googlemail.com'
     MAIL_PORT = 587
     MAIL_USE_TLS = True
-    if os.name == 'nt':
-        # $env:EMAIL_UHS12CONTACT = ""
-        MAIL_USERNAME = os.environ.get('EMAIL_UHS12CONTACT')
-        MAIL_PASSWORD = os.environ.get('UHS12CONTACT_PASS')
-        SECRET_KEY = os.environ.get("UHS_SECRET_KEY")
-        SQLALCHEMY_DATABASE_URI = os.environ.get("UHS_SQLALCHEMY_DATABASE_URI")
-    else:
-        with open('/etc/uhsconfig.json') as config_file:
-            config = json.load(config_file)
-        SQLALCHEMY_DATABASE_URI = config.get("UHS_SQLALCHEMY_DATABASE_URI")
-        SECRET_KEY = config.get("UHS_SECRET_KEY")
-        MAIL_USERNAME = config.get('EMAIL_UHS12CONTACT')
-        MAIL_PASSWORD = config.get('UHS12CONTACT_PASS')
-
+    # Outbox retries, waiting MAIL_RETRY_BASE seconds and doubling up to MAIL_RETRY_MAX
+    MAIL_MAX_ATTEMPTS = 8
+    MAIL_RETRY_BASE = 30
+    MAIL_RETRY_MAX = 3600
+    # One of ENGINE_PROFILES
+    DB_ENGINE_PROFILE = "default"
+    # Nothing listens for Flask-SQLAlchemy's model signals
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Show an approximate entry count on /tasklog, recounted at most every TASKLOG_COUNT_TTL seconds
+    TASKLOG_APPROX_TOTAL = False
+    TASKLOG_COUNT_TTL = 300
+    # `flask archive-tasklog` moves entries older than this to the archive, ARCHIVE_BATCH at a time
+    ARCHIVE_AFTER_DAYS = 365
+    ARCHIVE_BATCH = 1000
+    # Processes resizing uploaded pictures, and how many uploads may wait for them
+    IMAGE_WORKERS = 2
+    IMAGE_QUEUE_LIMIT = 8
+    SHAME_FEED_PER_PAGE = 10
+    # How long a logged in user's row is reused between requests, 0 to always query
+    USER_CACHE_TTL = 60
+    # bcrypt cost, and the threads hashing passwords. See uhs12app/users/passwords.py
+    BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE = 8
+    PASSWORD_HASH_WAIT = 2
+    # Rendered pages kept per worker, see uhs12app/cache.py. Pages are also
+    # rendered again every RESPONSE_CACHE_BUCKET seconds for anything that changes with time
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_SIZE = 512
+    RESPONSE_CACHE_BUCKET = 300
+    # Compiled templates are kept on disk across restarts, in Jinja's temp
+    # dir unless JINJA_BYTECODE_CACHE_DIR is set. Rendered {% cache %}
+    # fragments are kept per worker, see uhs12app/templating.py
+    JINJA_BYTECODE_CACHE = True
+    JINJA_BYTECODE_CACHE_DIR = None
+    FRAGMENT_CACHE_SIZE = 2048
+    # Static files are served from content addressed urls, see uhs12app/assets.
+    # Set to the prefix of an nginx internal location aliased to uhs12app/static
+    # to have nginx send them, or set USE_X_SENDFILE for Apache and lighttpd
+    ASSETS_ACCEL_REDIRECT = None
+    # Live updates, see uhs12app/events.py. A stream holds a worker thread, so
+    # each worker serves at most SSE_MAX_STREAMS, each for SSE_STREAM_SECONDS
+    # before the browser reconnects. Other workers' changes are noticed within
+    # SSE_POLL_INTERVAL seconds
+    SSE_MAX_STREAMS = 4
+    SSE_STREAM_SECONDS = 300
+    SSE_POLL_INTERVAL = 15
+    # e.g. http://example.com:5001 to subscribe with the aiohttp sidecar instead
+    SSE_SIDECAR_URL = None
+    SSE_SIDECAR_POLL = 2
+    SSE_TOKEN_TTL = 12 * 3600
+    # Request timings and SQL counts, see uhs12app/metrics. /metrics needs
+    # METRICS_TOKEN as a bearer token, or with no token only answers local requests
+    METRICS_ENABLED = True
+    METRICS_TOKEN = None
+    # Adds a Server-Timing header with each request's SQL and total time
+    SERVER_TIMING = True
+    # Statements taking longer are logged to uhs12app.slow_queries, 0 to log none
+    SLOW_QUERY_SECONDS = 0.25
@@ -0,0 +1,279 @@
+"""
+Streaming export and import of house data, for backups, moving data between
+databases and seeding test databases. See `flask export-data` and
+`flask import-data` in uhs12app/commands.py.
+
+Rows are read a batch at a time and written out as they come, so exporting
+a house with millions of TaskLog rows uses no more memory than a small one.
+JSONL puts every table in one file, one {"table": ..., "row": ...} per line.
+CSV writes a file per table into a directory, with \\N for NULL.
+
+On import every row gets a new id, and references to users, houses and tasks
+are rewritten to the new ids, so a house can be imported into a database
+that already has data. Users already in the database (matched by email) are
+reused rather than added. Rows are inserted in batches, each committed as it
+goes. Uploaded pictures are files, not rows, and are not copied.
+
+Archived task log entries are imported back into TaskLog, so their new ids
+come from the same sequence as the rest of the log, and their point rollups
+are left out. Totals are the same either way, and `flask archive-tasklog`
+archives and rolls them up again.
+"""
+import csv
+import datetime
+import json
+import os
+import secrets
+from sqlalchemy import Boolean, DateTime, Integer, or_
+from uhs12app import db
+from uhs12app.models import (
+    User, Membership, House, Invite, Task, TaskLog, TaskLogArchive, PointsRollup, ShamePost, TaskRequest,
+    TaskClaim
+)
+from uhs12app.users.passwords import hash_password
+
+NULL = "\\N"
+
+# Tables in the order they are written and read back, so every reference
+# is to a row imported before it
+TABLES = (User, House, Membership, Invite, Task, TaskRequest, TaskClaim, TaskLog, TaskLogArchive, PointsRollup,
+          ShamePost)
+MODELS = {model.__tablename__: model for model in TABLES}
+
+# Columns holding ids of other rows, and the table they refer to
+REFERENCES = {
+    "user": {"activeHouseId": "house"},
+    "house": {"adminId": "user"},
+    "membership": {"houseId": "house", "idUser": "user"},
+    "invite": {"houseId": "house", "idUserInvited": "user"},
+    "task": {"houseId": "house", "lastCompletedPersonId": "user"},
+    "task_request": {"houseId": "house", "taskId": "task", "userId": "user", "userClaimed": "user"},
+    "task_claim": {"houseId": "house", "taskId": "task", "userId": "user"},
+    "task_log": {"houseId": "house", "taskId": "task", "idUser": "user"},
+    "task_log_archive": {"houseId": "house", "taskId": "task", "idUser": "user"},
+    "points_rollup": {"houseId": "house", "idUser": "user"},
+    "shame_post": {"houseId": "house", "userId": "user"},
+}
+# Tables other rows refer to, which need their new ids kept
+MAPPED = ("user", "house", "task")
+# Tables imported into another one, and tables not imported at all
+IMPORT_INTO = {"task_log_archive": "task_log"}
+NOT_IMPORTED = ("points_rollup",)
+
+
+class DataError(Exception):
+    """The data can't be imported, the message says why"""
+
+
+def house_filter(model, house_id):
+    """Condition for the model's rows belonging to the house"""
+    if model is House:
+        return House.id == house_id
+    if model is User:
+        # Everyone who has been a member or been invited, so every reference is included
+        members = db.session.query(Membership.idUser).filter(Membership.houseId == house_id)
+        invited = db.session.query(Invite.idUserInvited).filter(Invite.houseId == house_id)
+        return or_(User.id.in_(members.subquery()), User.id.in_(invited.subquery()))
+    return model.houseId == house_id
+
+
+def scrub_user(row, password):
+    """Make a user unable to log in or be emailed, for copies of live data"""
+    row["email"] = f"user{row['id']}@example.invalid"
+    row["password"] = password
+    return row
+
+
+def export_rows(house_id=None, batch_size=1000, scrub=False):
+    """Yield (table name, row dict) for the house, or the whole database, a batch at a time"""
+    if scrub:
+        # A real hash of a secret nobody keeps, so logins check it like any other and fail
+        scrubbed_password = hash_password(secrets.token_hex(16))
+    for model in TABLES:
+        table = model.__table__
+        query = db.session.query(*table.columns).order_by(table.c.id)
+        if house_id is not None:
+            query = query.filter(house_filter(model, house_id))
+        for values in query.yield_per(batch_size):
+            row = dict(zip(table.columns.keys(), values))
+            if scrub and model is User:
+                row = scrub_user(row, scrubbed_password)
+            yield table.name, row
+
+
+def to_text(value):
+    if value is None:
+        return NULL
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def from_text(column, value):
+    """A value read from CSV or JSON, as the column's python type"""
+    if value is None or value == NULL:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+    if isinstance(column.type, Boolean):
+        return value in (True, 1, "1", "true", "True")
+    if isinstance(column.type, Integer):
+        return int(value)
+    return value
+
+
+def write_jsonl(out, rows):
+    written = 0
+    for table, row in rows:
+        out.write(json.dumps({"table": table, "row": {key: to_json(value) for key, value in row.items()}}))
+        out.write("\n")
+        written += 1
+    return written
+
+
+def to_json(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def read_jsonl(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            yield record["table"], record["row"]
+        except (ValueError, KeyError, TypeError):
+            raise DataError(f"Line {number} isn't a table row")
+
+
+def write_csv(directory, rows):
+    """Write a <table>.csv per table into directory"""
+    os.makedirs(directory, exist_ok=True)
+    written = 0
+    current, out, writer = None, None, None
+    try:
+        for table, row in rows:
+            if table != current:
+                if out:
+                    out.close()
+                current = table
+                out = open(os.path.join(directory, f"{table}.csv"), "w", newline="")
+                writer = csv.writer(out)
+                writer.writerow(row.keys())
+            writer.writerow([to_text(value) for value in row.values()])
+            written += 1
+    finally:
+        if out:
+            out.close()
+    return written
+
+
+def read_csv(directory):
+    for model in TABLES:
+        path = os.path.join(directory, f"{model.__tablename__}.csv")
+        if not os.path.exists(path):
+            continue
+        with open(path, newline="") as rows:
+            for row in csv.DictReader(rows):
+                yield model.__tablename__, row
+
+
+class Importer(object):
+    """Inserts exported rows with new ids, a batch at a time"""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        # table name -> {old id: new id}
+        self.new_ids = {table: {} for table in MAPPED}
+        self.counts = {}
+        # (old user id, old house id), set once the houses are in
+        self.active_houses = []
+        self.pending_table = None
+        self.pending = []
+
+    def add(self, table, raw_row):
+        if table in NOT_IMPORTED:
+            return
+        table = IMPORT_INTO.get(table, table)
+        model = MODELS.get(table)
+        if model is None:
+            raise DataError(f"Unknown table '{table}'")
+        columns = model.__table__.columns
+        row = {key: from_text(columns[key], value) for key, value in raw_row.items() if key in columns}
+        if table != self.pending_table:
+            self.flush()
+            self.pending_table = table
+        if table in MAPPED:
+            # Other rows need the new id, so these go in one at a time. There are few of them
+            self.insert_mapped(model, row)
+        else:
+            self.pending.append(self.remap(table, row))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def remap(self, table, row):
+        old_id = row.pop("id", None)
+        for column, target in REFERENCES[table].items():
+            if row.get(column) is None:
+                continue
+            if table == "user" and column == "activeHouseId":
+                # Houses come after users, so this is set at the end
+                self.active_houses.append((old_id, row[column]))
+                row[column] = None
+                continue
+            new_id = self.new_ids[target].get(row[column])
+            if new_id is None:
+                raise DataError(f"{table} {old_id} refers to {target} {row[column]}, which isn't in the data")
+            row[column] = new_id
+        return row
+
+    def insert_mapped(self, model, row):
+        table = model.__tablename__
+        old_id = row.get("id")
+        existing = None
+        if model is User:
+            existing = db.session.query(User.id).filter_by(email=row["email"]).scalar()
+            if existing is None and db.session.query(User.id).filter_by(username=row["username"]).scalar():
+                row["username"] = f"{row['username'][:12]}-{old_id}"[:20]
+        if existing is None:
+            row = self.remap(table, row)
+            new_id = db.session.execute(model.__table__.insert(), row).inserted_primary_key[0]
+            self.counts[table] = self.counts.get(table, 0) + 1
+        else:
+            new_id = existing
+            self.counts["user (existing)"] = self.counts.get("user (existing)", 0) + 1
+        self.new_ids[table][old_id] = new_id
+        if len(self.new_ids[table]) % self.batch_size == 0:
+            db.session.commit()
+
+    def flush(self):
+        if self.pending:
+            db.session.execute(MODELS[self.pending_table].__table__.insert(), self.pending)
+            self.counts[self.pending_table] = self.counts.get(self.pending_table, 0) + len(self.pending)
+            self.pending = []
+        db.session.commit()
+
+    def finish(self):
+        self.flush()
+        for old_user_id, old_house_id in self.active_houses:
+            new_house_id = self.new_ids["house"].get(old_house_id)
+            if new_house_id and old_user_id in self.new_ids["user"]:
+                User.query.filter_by(id=self.new_ids["user"][old_user_id]).update(
+                    {User.activeHouseId: new_house_id}, synchronize_session=False
+                )
+        db.session.commit()
+        return self.counts
+
+
+def import_rows(rows, batch_size=1000):
+    """Insert (table name, row) pairs as exported. Returns rows added per table"""
+    importer = Importer(batch_size)
+    try:
+        for table, row in rows:
+            importer.add(table, row)
+        return importer.finish()
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,42 @@
+"""
+Database engine setup for the profile chosen with DB_ENGINE_PROFILE
+"""
+import sqlalchemy.pool
+from sqlalchemy import event
+from uhs12app.config import ENGINE_PROFILES
+
+
+def engine_profile(app):
+    name = app.config["DB_ENGINE_PROFILE"]
+    if name not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown DB_ENGINE_PROFILE '{name}', choose one of {', '.join(ENGINE_PROFILES)}")
+    return ENGINE_PROFILES[name]
+
+
+def apply_engine_options(app):
+    """Set SQLALCHEMY_ENGINE_OPTIONS from the profile. Must run before the engine is created"""
+    options = dict(engine_profile(app)["engine_options"])
+    if isinstance(options.get("poolclass"), str):
+        options["poolclass"] = getattr(sqlalchemy.pool, options["poolclass"])
+    # Anything set explicitly in the config wins over the profile
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def set_sqlite_pragmas(engine, pragmas):
+    """Run the pragmas on every new connection the engine makes"""
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def init_engine(app, db):
+    """Create the app's engine with the profile's options and connection setup"""
+    with app.app_context():
+        set_sqlite_pragmas(db.get_engine(), engine_profile(app)["sqlite_pragmas"])
@@ -1,4 +1,5 @@
 from flask import Blueprint, render_template
+from uhs12app.executors import ExecutorBusy
 
 errors = Blueprint('errors', __name__)
 
@@ -17,3 +18,9 @@ def error_403(error):
 def error_500(error):
 
     return render_template('errors/500.html'), 500
+
+
+@errors.app_errorhandler(ExecutorBusy)
+def error_busy(error):
+
+    return render_template('errors/503.html'), 503, {"Retry-After": "5"}
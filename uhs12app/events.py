@@ -0,0 +1,198 @@
+"""
+Live updates for a house, sent to browsers as server-sent events.
+
+Routes changing a house queue an event with house_event() (bump_house_version
+queues a plain "changed" one), and the events are handed to the broker once
+the session commits, so subscribers never hear about changes that were rolled
+back. The broker fans each event out to the streams of that house open in this
+process.
+
+Workers are separate processes, so a stream also polls the house version now
+and then and sends "changed" when it has moved, which covers changes made in
+other workers.
+For lots of idle subscribers, run the aiohttp sidecar (uhs12app/sse_server.py)
+and set SSE_SIDECAR_URL; pages then subscribe there with a signed token
+instead of holding a worker thread each.
+"""
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from sqlalchemy import event, select
+from uhs12app import db
+
+CHANGED = "changed"
+
+
+class Subscription(object):
+    """Events for one stream. Drops old events rather than grow if the client stops reading"""
+
+    def __init__(self, house_id, maxsize=100):
+        self.house_id = house_id
+        self.events = queue.Queue(maxsize)
+
+    def put(self, house_event):
+        try:
+            self.events.put_nowait(house_event)
+        except queue.Full:
+            # The client will see the newest state anyway
+            pass
+
+    def get(self, timeout):
+        """The next event, or None after timeout seconds"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker(object):
+    """Fans events out to the subscriptions of each house"""
+
+    def __init__(self):
+        self._houses = {}
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def subscribe(self, house_id):
+        subscription = Subscription(house_id)
+        with self._lock:
+            self._houses.setdefault(house_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._houses.get(subscription.house_id, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._houses.pop(subscription.house_id, None)
+
+    def publish(self, house_id, house_event):
+        with self._lock:
+            subscribers = list(self._houses.get(house_id, ()))
+        for subscription in subscribers:
+            subscription.put(house_event)
+
+    def stream_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._houses.values())
+
+    def version(self, house_id, max_age):
+        """House.version, read at most once per max_age seconds however many streams ask"""
+        from uhs12app.models import House
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(house_id)
+        if cached and now - cached[1] < max_age:
+            return cached[0]
+        with db.engine.connect() as connection:
+            version = connection.execute(select([House.version]).where(House.id == house_id)).scalar()
+        with self._lock:
+            self._versions[house_id] = (version, now)
+        return version
+
+
+broker = Broker()
+
+
+def house_event(house_id, kind=CHANGED, **data):
+    """Queue an event for the house's subscribers, sent if the current transaction commits"""
+    if not house_id:
+        return
+    pending = db.session.info.setdefault("house_events", OrderedDict())
+    events = pending.setdefault(house_id, [])
+    if kind != CHANGED:
+        events.append(dict(data, type=kind))
+
+
+def _publish_pending(session):
+    pending = session.info.pop("house_events", None)
+    for house_id, events in (pending or {}).items():
+        # A house that changed without saying how just gets "changed"
+        for house_event in events or [{"type": CHANGED}]:
+            broker.publish(house_id, house_event)
+
+
+def _drop_pending(session, *args):
+    session.info.pop("house_events", None)
+
+
+def init_events(db):
+    if not event.contains(db.session, "after_commit", _publish_pending):
+        event.listen(db.session, "after_commit", _publish_pending)
+        event.listen(db.session, "after_soft_rollback", _drop_pending)
+
+
+def format_event(house_event=None, event_id=None, comment=None):
+    """One server-sent event, as text for the stream"""
+    lines = []
+    if comment:
+        lines.append(f": {comment}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if house_event:
+        lines.append(f"event: {house_event['type']}")
+        lines.append(f"data: {json.dumps(house_event)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def stream_events(house_id, poll_interval, duration, last_seen=None):
+    """
+    Yield the house's events as they come, plus a "changed" whenever its
+    version moves on. Returns after duration seconds, the browser then
+    reconnects, sending the last version it saw as last_seen.
+    """
+    # Subscribe before reading the version, so no change can fall between the two.
+    # Done in here so a stream that is never started doesn't leave a subscription behind
+    subscription = broker.subscribe(house_id)
+    try:
+        version = broker.version(house_id, 0)
+        # Tell the browser to reconnect after 3 seconds if the stream drops
+        yield "retry: 3000\n" + format_event(event_id=version)
+        if last_seen is not None and last_seen != str(version):
+            yield format_event({"type": CHANGED}, event_id=version)
+        deadline = time.monotonic() + duration
+        next_poll = time.monotonic() + poll_interval
+        while time.monotonic() < deadline:
+            house_event = subscription.get(timeout=max(0, min(next_poll, deadline) - time.monotonic()))
+            if house_event:
+                yield format_event(house_event)
+                continue
+            if time.monotonic() < next_poll:
+                continue
+            next_poll = time.monotonic() + poll_interval
+            latest = broker.version(house_id, poll_interval)
+            if latest != version:
+                version = latest
+                yield format_event({"type": CHANGED}, event_id=version)
+            else:
+                # Keeps proxies from closing an idle stream, and finds clients that went away
+                yield format_event(comment="ping")
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def sidecar_token(app, house_id, user_id):
+    serializer = Serializer(app.config["SECRET_KEY"], app.config["SSE_TOKEN_TTL"])
+    return serializer.dumps({"house": house_id, "user": user_id}).decode("utf-8")
+
+
+def verify_sidecar_token(app, token):
+    """The house id the token is for, or None"""
+    serializer = Serializer(app.config["SECRET_KEY"])
+    try:
+        return int(serializer.loads(token)["house"])
+    except Exception:
+        return None
+
+
+def events_url(app, house_id, user_id):
+    """Where a page for the house subscribes"""
+    from flask import url_for
+    sidecar = app.config.get("SSE_SIDECAR_URL")
+    if sidecar:
+        token = sidecar_token(app, house_id, user_id)
+        return f"{sidecar.rstrip('/')}/houses/{house_id}/events?token={token}"
+    return url_for("api.events")
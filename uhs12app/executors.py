@@ -0,0 +1,38 @@
+"""
+Executors with a cap on queued work.
+
+A plain concurrent.futures executor queues without limit, so a burst of slow
+jobs backs up behind the workers while the requests that submitted them wait.
+BoundedExecutor refuses work once max_pending jobs are queued or running and
+raises ExecutorBusy, which the caller can turn into a quick "try again".
+"""
+import threading
+
+
+class ExecutorBusy(Exception):
+    """The executor already has as much work as it is allowed to queue"""
+
+
+class BoundedExecutor(object):
+    def __init__(self, executor, max_pending):
+        self._executor = executor
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args, wait=0, **kwargs):
+        """
+        Submit fn(*args, **kwargs). Waits up to `wait` seconds for a free slot,
+        then raises ExecutorBusy.
+        """
+        acquired = self._slots.acquire(timeout=wait) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            raise ExecutorBusy()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,67 @@
+"""
+Points leaderboard for a house, computed with a single grouped query.
+Points from entries moved out of TaskLog come from PointsRollup, see uhs12app/archive.py
+"""
+import datetime
+from collections import OrderedDict
+from sqlalchemy import func, union_all
+from uhs12app.models import User, Membership, TaskLog, PointsRollup
+
+WINDOW_ALL = "all"
+WINDOW_WEEK = "week"
+WINDOW_MONTH = "month"
+WINDOWS = (WINDOW_ALL, WINDOW_WEEK, WINDOW_MONTH)
+
+
+def window_start(window, now=None):
+    """
+    Start of the window containing now, or None for all-time.
+    Weeks start on Monday, months on the 1st, both at midnight utc.
+    """
+    if window not in WINDOWS:
+        raise ValueError(f"Unknown leaderboard window '{window}'")
+    if window == WINDOW_ALL:
+        return None
+    now = now or datetime.datetime.utcnow()
+    midnight = datetime.datetime(now.year, now.month, now.day)
+    if window == WINDOW_WEEK:
+        return midnight - datetime.timedelta(days=midnight.weekday())
+    return midnight.replace(day=1)
+
+
+def leaderboard(session, house_id, window=WINDOW_ALL, now=None):
+    """
+    Points per active member of the house, highest first.
+    Returns an OrderedDict of User -> points. Members with no completed
+    tasks in the window are included with 0 points.
+    """
+    start = window_start(window, now)
+    recent = session.query(
+        TaskLog.idUser.label("idUser"), func.sum(TaskLog.value).label("points")
+    ).filter(TaskLog.houseId == house_id)
+    archived = session.query(
+        PointsRollup.idUser.label("idUser"), func.sum(PointsRollup.points).label("points")
+    ).filter(PointsRollup.houseId == house_id)
+    if start is not None:
+        recent = recent.filter(TaskLog.dateCreated >= start)
+        archived = archived.filter(PointsRollup.periodStart >= start)
+    both = union_all(
+        recent.group_by(TaskLog.idUser).statement, archived.group_by(PointsRollup.idUser).statement
+    ).alias()
+    totals = (
+        session.query(both.c.idUser.label("idUser"), func.sum(both.c.points).label("points"))
+        .group_by(both.c.idUser)
+        .subquery()
+    )
+    active_members = session.query(Membership.idUser).filter(
+        Membership.houseId == house_id, Membership.isExpired == False
+    )
+    points = func.coalesce(totals.c.points, 0)
+    rows = (
+        session.query(User, points)
+        .outerjoin(totals, totals.c.idUser == User.id)
+        .filter(User.id.in_(active_members.subquery()))
+        .order_by(points.desc(), User.username)
+        .all()
+    )
+    return OrderedDict((user, int(pts)) for user, pts in rows)
@@ -1,4 +1,4 @@
-from flask import render_template, url_for, flash, redirect, request
+from flask import render_template, url_for, flash, redirect, request, abort
 from flask_login import current_user, login_required
 from uhs12app import db
 from uhs12app.house.forms import (
@@ -6,14 +6,18 @@ from uhs12app.house.forms import (
     JoinHouseForm,
     ReplyInviteForm,
 )
-from uhs12app.models import User, House, Invite, TaskLog, Membership
+from uhs12app.models import User, House, Invite, TaskLog, Membership, forget_memberships
+from uhs12app.house.leaderboard import leaderboard, WINDOWS, WINDOW_ALL
+from uhs12app.users.cache import user_cache
+from uhs12app.cache import cached_house_page, bump_house_version
 
 from flask import Blueprint
 
 house = Blueprint('house', __name__)
 
-@house.route("/myhouse", methods=["GET", "POST"])
+@house.route("/myhouse")
 @login_required
+@cached_house_page
 def myhouse():
     """
     This lists the members of the house and the points that they each have 
@@ -22,33 +26,60 @@ def myhouse():
         return redirect(url_for("house.whathouse"))
     house = House.query.filter_by(id=current_user.activeHouseId).first()
     # TODO only allow the admin user to see the invites
-    invitesWaiting = {}
-    for invite in Invite.query.filter_by(
-        houseId=current_user.activeHouseId, isResponded=False
-    ).all():
-        user = User.query.filter_by(id=invite.idUserInvited).first()
-        # TODO understand why prefix is necessary, without it both forms are submitted together
-        invitesWaiting[user] = ReplyInviteForm(prefix="{}".format(user.username))
-    for invUser, invForm in invitesWaiting.items():
-        if invForm.validate_on_submit():
-            invite = Invite.query.filter_by(
-                houseId=current_user.activeHouseId,
-                idUserInvited=invUser.id,
-                isResponded=False,
-            ).first()
-            invite.isResponded = True
-            if invForm.submitAccept.data:
-                invUser.activeHouseId = current_user.activeHouseId
-                newMembership = Membership(houseId=current_user.activeHouseId, idUser=invUser.id)
-                db.session.add(newMembership)
-            if invForm.submitDecline.data:
-                # TODO send the user a message about the invite being declined?
-                pass
-            db.session.commit()
-            return redirect(url_for("house.myhouse"))
-    # TODO make this an OrderedDict and sort by person with most points
-    pts_users = TaskLog.pointsAllUsers(db.session, current_user.activeHouseId)
-    return render_template("myhouse.html", house=house.name, invites=invitesWaiting, points=pts_users)
+    invitesWaiting = (
+        db.session.query(Invite, User)
+        .join(User, User.id == Invite.idUserInvited)
+        .filter(Invite.houseId == current_user.activeHouseId, Invite.isResponded == False)
+        .order_by(Invite.id)
+        .all()
+    )
+    window = request.args.get("window", WINDOW_ALL)
+    if window not in WINDOWS:
+        window = WINDOW_ALL
+    pts_users = leaderboard(db.session, current_user.activeHouseId, window)
+    return render_template(
+        "myhouse.html",
+        house=house.name,
+        invites=invitesWaiting,
+        # One form for all the invites, each posts to its own invite's url
+        reply_form=ReplyInviteForm(),
+        points=pts_users,
+        window=window,
+        windows=WINDOWS,
+    )
+
+
+@house.route("/invite/<int:invite_id>/reply", methods=["POST"])
+@login_required
+def replyinvite(invite_id):
+    """
+    Accept or decline a request to join the active house
+    """
+    form = ReplyInviteForm()
+    if not form.validate_on_submit():
+        abort(400)
+    houseId = current_user.activeHouseId
+    invitedId = (
+        db.session.query(Invite.idUserInvited)
+        .filter_by(id=invite_id, houseId=houseId, isResponded=False)
+        .filter(Membership.isActive(current_user.id, houseId))
+        .scalar()
+    )
+    # Only the request that flips isResponded gets to act on the invite
+    answered = invitedId is not None and Invite.query.filter_by(id=invite_id, isResponded=False).update(
+        {Invite.isResponded: True}, synchronize_session=False
+    )
+    if not answered:
+        flash("That request has already been answered, or isn't yours to answer", "info")
+        return redirect(url_for("house.myhouse"))
+    if form.submitAccept.data:
+        db.session.execute(Membership.__table__.insert().values(houseId=houseId, idUser=invitedId, isExpired=False))
+        User.query.filter_by(id=invitedId).update({User.activeHouseId: houseId}, synchronize_session=False)
+    # TODO send the user a message about the invite being declined?
+    bump_house_version(houseId)
+    db.session.commit()
+    user_cache.invalidate(invitedId)
+    return redirect(url_for("house.myhouse"))
 
 
 @house.route("/whathouse")
@@ -99,6 +130,7 @@ def create():
         newMembership = Membership(houseId=newHouse.id, idUser=current_user.id)
         db.session.add(newMembership)
         db.session.commit()
+        user_cache.invalidate(current_user.id)
         flash(f"House {houseForm.name.data} created!", "success")
         return redirect(url_for("tasks.home"))
     return render_template("create.html", form=houseForm)
@@ -127,21 +159,22 @@ def join():
         if not house:
             flash(f"No house exists with that name!", "info")
             return redirect(url_for("house.whathouse"))
-        if not house.active_memberships():
+        if not house.has_active_members():
             # If a house is empty, and previous member can join freely
-            membership = Membership.query.filter_by(houseId=house.id, idUser=current_user.id).first()
-            memall = Membership.query.filter_by().all()
-            if membership:
+            if current_user.has_been_member(house.id):
                 current_user.activeHouseId = house.id
                 newMembership = Membership(houseId=house.id, idUser=current_user.id)
                 db.session.add(newMembership)
+                bump_house_version(house.id)
                 db.session.commit()
+                user_cache.invalidate(current_user.id)
                 flash(f"You have joined {house.name}!", "success")
                 return redirect(url_for("house.myhouse"))
             flash(f"That house is not accepting new members!", "info")
             return redirect(url_for("house.whathouse"))
         new_invite = Invite(houseId=house.id, idUserInvited=current_user.id)
         db.session.add(new_invite)
+        bump_house_version(house.id)
         db.session.commit()
         flash(f"Requested to join {join_form.name.data}!", "success")
         return redirect(url_for("house.whathouse"))
@@ -159,13 +192,19 @@ def leavehouse():
     """
     expired_house_id = int(request.args.get("houseid"))
     assert current_user.activeHouseId == expired_house_id
-    for membrship in current_user.active_memberships():
-        if membrship.houseId == expired_house_id:
-            membrship.isExpired = True
-    if current_user.active_memberships():
+    Membership.query.filter_by(idUser=current_user.id, houseId=expired_house_id, isExpired=False).update(
+        {Membership.isExpired: True}, synchronize_session=False
+    )
+    forget_memberships()
+    bump_house_version(expired_house_id)
+    remaining = current_user.active_memberships()
+    if remaining:
         # Assign random other one, doesn't matter which
-        current_user.activeHouseId = current_user.active_memberships()[0].houseId
+        current_user.activeHouseId = remaining[0].houseId
+        db.session.commit()
+        user_cache.invalidate(current_user.id)
         return redirect(url_for("house.myhouse"))
     current_user.activeHouseId = None
     db.session.commit()
+    user_cache.invalidate(current_user.id)
     return redirect(url_for("house.whathouse"))
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Outgoing mail, sent in the background.
+
+Routes never talk to the SMTP server. queue_mail() stores the message in the
+outbox_mail table as part of the request's transaction, and the worker
+(`flask send-mail --interval 10`) sends whatever is due over one SMTP
+connection per batch. Failed messages are retried with exponential backoff
+until MAIL_MAX_ATTEMPTS, then left marked as failed.
+
+Run a single worker. To try it without a real mail account, point
+UHS_MAIL_SERVER/UHS_MAIL_PORT at a local stand-in with UHS_MAIL_USE_TLS=0,
+e.g. `python -m aiosmtpd -n -l localhost:8025` after `pip install aiosmtpd`.
+tests/test_mailer.py runs the worker against a stand-in in the test process.
+"""
+import datetime
+from flask import current_app
+from flask_mail import Message
+from uhs12app import db, mail
+from uhs12app.models import OutboxMail
+
+
+def queue_mail(subject, sender, recipients, body):
+    """Add a message to the outbox. It is sent once the caller commits"""
+    outgoing = OutboxMail(subject=subject, sender=sender, recipients=",".join(recipients), body=body)
+    db.session.add(outgoing)
+    return outgoing
+
+
+def retry_delay(attempts):
+    """How long to wait before the next attempt, after `attempts` failures"""
+    base = current_app.config["MAIL_RETRY_BASE"]
+    return datetime.timedelta(seconds=min(base * 2 ** (attempts - 1), current_app.config["MAIL_RETRY_MAX"]))
+
+
+def _record_failure(outgoing, error, now):
+    outgoing.attempts += 1
+    outgoing.lastError = repr(error)[:200]
+    if outgoing.attempts >= current_app.config["MAIL_MAX_ATTEMPTS"]:
+        outgoing.status = OutboxMail.STATUS_FAILED
+        current_app.logger.error("Giving up on mail %s to %s: %r", outgoing.id, outgoing.recipients, error)
+    else:
+        outgoing.nextAttemptDate = now + retry_delay(outgoing.attempts)
+
+
+def send_pending(batch_size=50, now=None):
+    """
+    Send up to batch_size messages that are due. Returns (sent, failed) counts.
+    """
+    now = now or datetime.datetime.utcnow()
+    due = (
+        OutboxMail.query.filter(OutboxMail.status == OutboxMail.STATUS_PENDING, OutboxMail.nextAttemptDate <= now)
+        .order_by(OutboxMail.nextAttemptDate)
+        .limit(batch_size)
+        .all()
+    )
+    if not due:
+        return 0, 0
+    sent = failed = 0
+    try:
+        with mail.connect() as connection:
+            for outgoing in due:
+                msg = Message(
+                    outgoing.subject, sender=outgoing.sender, recipients=outgoing.recipients.split(","), body=outgoing.body
+                )
+                try:
+                    connection.send(msg)
+                except Exception as err:
+                    # The connection may be unusable now, leave the rest for the next batch
+                    _record_failure(outgoing, err, now)
+                    failed += 1
+                    db.session.commit()
+                    break
+                outgoing.status = OutboxMail.STATUS_SENT
+                outgoing.dateSent = datetime.datetime.utcnow()
+                sent += 1
+                # Commit each one so a crash part way through never sends a message twice
+                db.session.commit()
+    except Exception as err:
+        # Couldn't connect or log in. Back off every message in the batch that is still waiting
+        for outgoing in due:
+            if outgoing.status == OutboxMail.STATUS_PENDING and outgoing.nextAttemptDate <= now:
+                _record_failure(outgoing, err, now)
+                failed += 1
+        db.session.commit()
+    return sent, failed
@@ -0,0 +1,120 @@
+"""
+Background processing of wall of shame uploads.
+
+Resizing a phone photo takes long enough that doing it in the request holds
+up a worker, so uploads are handed to a small process pool instead. Each
+upload is saved as a few resized variants named after a hash of its content,
+so uploading the same picture twice reuses the files already on disk.
+"""
+import hashlib
+import os
+import threading
+from uhs12app import db
+from uhs12app.executors import BoundedExecutor
+
+# Largest width/height of each variant
+VARIANTS = (
+    ("thumb", (320, 320)),
+    ("feed", (1024, 1024)),
+    ("full", (2048, 2048)),
+)
+VARIANT_NAMES = ",".join(name for name, _ in VARIANTS)
+SUB_DIR = "wos_pics"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def variant_filename(image_hash, variant):
+    return f"{image_hash[:32]}_{variant}.jpg"
+
+
+def image_dir(app):
+    return os.path.join(app.root_path, "static", SUB_DIR)
+
+
+def make_variants(data, out_dir, image_hash):
+    """
+    Write every variant of the image to out_dir. Runs in a pool process.
+    Variants that already exist are left alone.
+    """
+    import io
+    from PIL import Image, ImageOps
+
+    os.makedirs(out_dir, exist_ok=True)
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    for variant, size in VARIANTS:
+        path = os.path.join(out_dir, variant_filename(image_hash, variant))
+        if os.path.exists(path):
+            continue
+        resized = img.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        # Write to a temp file first so a half written variant is never served
+        tmp_path = path + ".tmp"
+        resized.save(tmp_path, "JPEG", quality=82, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+    return image_hash
+
+
+def variants_exist(out_dir, image_hash):
+    return all(os.path.exists(os.path.join(out_dir, variant_filename(image_hash, variant))) for variant, _ in VARIANTS)
+
+
+def image_pool(app, replace_broken=None):
+    """
+    Process pool shared by all requests in this worker, created on first upload.
+    Pass the pool that failed as replace_broken to start a new one in its place.
+    """
+    # concurrent.futures.process pulls in multiprocessing, only load it once there's an upload
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool is replace_broken:
+            _pool.shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            executor = ProcessPoolExecutor(max_workers=app.config["IMAGE_WORKERS"])
+            _pool = BoundedExecutor(executor, app.config["IMAGE_QUEUE_LIMIT"])
+        return _pool
+
+
+def _mark_processed(app, image_hash, future):
+    """Record the result on every post waiting on this image"""
+    from uhs12app.models import ShamePost
+    from uhs12app.cache import bump_house_version
+    status = ShamePost.STATUS_FAILED if future.exception() else ShamePost.STATUS_READY
+    if future.exception():
+        app.logger.error("Processing image %s failed: %r", image_hash, future.exception())
+    with app.app_context():
+        try:
+            waiting = ShamePost.query.filter_by(imageHash=image_hash, status=ShamePost.STATUS_PENDING)
+            for house_id, in waiting.with_entities(ShamePost.houseId).distinct():
+                bump_house_version(house_id)
+            waiting.update({ShamePost.status: status}, synchronize_session=False)
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def submit_shame_image(app, image_hash, data):
+    """
+    Process an upload for committed ShamePosts in the background.
+    Raises ExecutorBusy if the pool already has a full queue.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+
+    pool = image_pool(app)
+    try:
+        future = pool.submit(make_variants, data, image_dir(app), image_hash)
+    except BrokenProcessPool:
+        # A pool process died, e.g. killed for memory. The pool can't be used again
+        future = image_pool(app, replace_broken=pool).submit(make_variants, data, image_dir(app), image_hash)
+    future.add_done_callback(lambda f: _mark_processed(app, image_hash, f))
+    return future
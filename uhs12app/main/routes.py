@@ -1,4 +1,4 @@
-from flask import render_template, url_for, flash, redirect
+from flask import render_template, url_for, flash, redirect, request, abort, current_app
 from flask_login import current_user, login_required
 from uhs12app import db
 from uhs12app.main.forms import (
@@ -6,30 +6,77 @@ from uhs12app.main.forms import (
 )
 from uhs12app.models import ShamePost
 from flask import Blueprint
-from uhs12app.users.utils import save_picture
+from uhs12app.executors import ExecutorBusy
+from uhs12app.pagination import KeysetPage
+from uhs12app.cache import cached_house_page, bump_house_version
+from uhs12app.main.images import (
+    content_hash,
+    image_dir,
+    submit_shame_image,
+    variant_filename,
+    variants_exist,
+    VARIANT_NAMES,
+)
 
 main = Blueprint('main', __name__)
 
 
 @main.route("/wallofshame", methods=["GET", "POST"])
 @login_required
+@cached_house_page
 def wallofshame():
     if not current_user.activeHouseId:
         return redirect(url_for("house.whathouse"))
     # TODO Tally disapprovals and apply them when user leaves the page
     shame_form = NewShamePostForm()
     if shame_form.validate_on_submit():
-        pic_name = save_picture(shame_form.picture.data, sub_dir="wos_pics", output_size=(1024, 1024))
+        data = shame_form.picture.data.read()
+        image_hash = content_hash(data)
+        # The same picture uploaded before can reuse the files already saved
+        is_processed = variants_exist(image_dir(current_app), image_hash)
         shame_post = ShamePost(
             houseId=current_user.activeHouseId,
             userId=current_user.id,
-            postImage=pic_name,
+            postImage=variant_filename(image_hash, "feed"),
+            imageHash=image_hash,
+            variants=VARIANT_NAMES,
+            status=ShamePost.STATUS_READY if is_processed else ShamePost.STATUS_PENDING,
         )
         db.session.add(shame_post)
+        bump_house_version(current_user.activeHouseId)
         db.session.commit()
+        if not is_processed:
+            try:
+                submit_shame_image(current_app._get_current_object(), image_hash, data)
+            except ExecutorBusy:
+                db.session.delete(shame_post)
+                db.session.commit()
+                flash("Lots of shame being cast right now! Try again in a moment", "warning")
+                return redirect(url_for("main.wallofshame"))
         flash(f"Hooray! You have cast shame!", "success")
         return redirect(url_for("main.wallofshame"))
     
-    shame_posts = ShamePost.query.order_by(ShamePost.dateCreated.desc()).filter_by(houseId=current_user.activeHouseId).all()
+    return render_template("wallofshame.html", shame_page=shame_feed_page(), form=shame_form)
+
+
+@main.route("/wallofshame/feed")
+@login_required
+@cached_house_page
+def wallofshame_feed():
+    """
+    Just the next chunk of posts, for scrolling further down the wall
+    """
+    if not current_user.activeHouseId:
+        abort(404)
+    return render_template("shamefeed.html", shame_page=shame_feed_page())
+
 
-    return render_template("wallofshame.html", shame_posts=shame_posts, form=shame_form)
+def shame_feed_page():
+    """The page of the current house's wall starting after the ?after= cursor"""
+    return KeysetPage(
+        ShamePost.query.filter_by(houseId=current_user.activeHouseId),
+        ShamePost.dateCreated,
+        ShamePost.id,
+        per_page=current_app.config["SHAME_FEED_PER_PAGE"],
+        after=request.args.get("after"),
+    )
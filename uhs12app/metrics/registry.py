@@ -0,0 +1,155 @@
+"""
+Per request timings and SQL statement counts, kept in this process.
+
+Every statement run while handling a request is counted and timed against
+the request, statements slower than SLOW_QUERY_SECONDS are logged to the
+uhs12app.slow_queries logger along with the route that ran them, and each
+request's totals go into per endpoint histograms for /metrics.
+"""
+import bisect
+import logging
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+slow_query_log = logging.getLogger("uhs12app.slow_queries")
+
+
+class Histogram(object):
+    """Counts of observations at or under each bucket, Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations at or under it), ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield bound, total
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0
+        self.slow_queries = 0
+
+
+class Registry(object):
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, queries, db_seconds, slow_queries):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.latency.observe(seconds)
+            stats.queries.observe(queries)
+            stats.db_seconds += db_seconds
+            stats.slow_queries += slow_queries
+
+    def render(self):
+        """Everything recorded, in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            for name, kind, help_text in (
+                ("uhs12_request_seconds", "histogram", "Time to handle a request"),
+                ("uhs12_request_queries", "histogram", "SQL statements run per request"),
+                ("uhs12_request_db_seconds_total", "counter", "Time spent running SQL statements"),
+                ("uhs12_slow_queries_total", "counter", "SQL statements slower than SLOW_QUERY_SECONDS"),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for endpoint, stats in endpoints:
+                    label = f'endpoint="{endpoint}"'
+                    if kind == "histogram":
+                        histogram = stats.latency if name == "uhs12_request_seconds" else stats.queries
+                        for bound, total in histogram.cumulative():
+                            lines.append(f'{name}_bucket{{{label},le="{bound}"}} {total}')
+                        lines.append(f"{name}_sum{{{label}}} {histogram.sum}")
+                        lines.append(f"{name}_count{{{label}}} {histogram.count}")
+                    elif name == "uhs12_request_db_seconds_total":
+                        lines.append(f"{name}{{{label}}} {stats.db_seconds}")
+                    else:
+                        lines.append(f"{name}{{{label}}} {stats.slow_queries}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = Registry()
+
+
+def current_endpoint():
+    return request.endpoint or "unmatched"
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0
+    g.slow_queries = 0
+
+
+def finish_request():
+    """Record the request's totals. Returns (seconds, statements, statement seconds)"""
+    if "request_started" not in g:
+        return None
+    seconds = time.perf_counter() - g.request_started
+    registry.record(current_endpoint(), seconds, g.sql_statements, g.sql_seconds, g.slow_queries)
+    return seconds, g.sql_statements, g.sql_seconds
+
+
+def time_statements(engine, slow_seconds):
+    """Count and time the engine's statements against the request running them"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("statement_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "handle_error")
+    def on_error(context):
+        if context.connection is not None and context.connection.info.get("statement_started"):
+            context.connection.info["statement_started"].pop()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_execute(connection, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - connection.info["statement_started"].pop()
+        in_request = has_request_context() and "request_started" in g
+        if in_request:
+            g.sql_statements += 1
+            g.sql_seconds += seconds
+        if slow_seconds and seconds >= slow_seconds:
+            if in_request:
+                g.slow_queries += 1
+            slow_query_log.warning(
+                "%.3fs in %s %s: %s",
+                seconds,
+                current_endpoint() if in_request else "(no request)",
+                request.path if in_request else "",
+                " ".join(statement.split())[:500],
+            )
+
+
+def init_metrics(app, db):
+    with app.app_context():
+        time_statements(db.get_engine(), app.config["SLOW_QUERY_SECONDS"])
@@ -0,0 +1,41 @@
+import hmac
+from flask import Blueprint, Response, abort, current_app, request
+from uhs12app.metrics.registry import registry, start_request, finish_request
+
+metrics = Blueprint('metrics', __name__)
+
+LOOPBACK = ("127.0.0.1", "::1")
+
+
+@metrics.before_app_request
+def start_timing():
+    if current_app.config["METRICS_ENABLED"]:
+        start_request()
+
+
+@metrics.after_app_request
+def record_timing(response):
+    totals = finish_request()
+    if totals and current_app.config["SERVER_TIMING"]:
+        seconds, statements, sql_seconds = totals
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={sql_seconds * 1000:.1f};desc="{statements} queries", app;dur={seconds * 1000:.1f}',
+        )
+    return response
+
+
+def allowed():
+    """With METRICS_TOKEN set it's needed as a bearer token, otherwise only local, unproxied requests are allowed"""
+    token = current_app.config.get("METRICS_TOKEN")
+    if token:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    return request.remote_addr in LOOPBACK and "X-Forwarded-For" not in request.headers
+
+
+@metrics.route("/metrics")
+def show_metrics():
+    """This worker's request metrics, in the Prometheus text format"""
+    if not current_app.config["METRICS_ENABLED"] or not allowed():
+        abort(404)
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
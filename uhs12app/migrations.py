@@ -0,0 +1,148 @@
+"""
+Schema migrations for existing databases.
+
+db.create_all() only creates tables that are missing, so anything added to
+a table that already exists (indexes, columns) is applied here instead.
+Each migration runs once, in order, and is recorded in the schema_version
+table. Migrations are written to be safe on a database that create_all()
+has just built, so a fresh database can be upgraded straight away.
+"""
+import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect
+from sqlalchemy.schema import CreateColumn
+from uhs12app import db
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(120), nullable=False),
+    Column("dateApplied", DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration. Versions must be added in increasing order"""
+    def register(func):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] < version, "Migrations must be added in order"
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+def create_missing_indexes(connection, model):
+    """Create any index declared on the model that the database doesn't have yet"""
+    table = model.__table__
+    existing = {index["name"] for index in inspect(connection).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(connection)
+
+
+def add_missing_columns(connection, model, *names):
+    """ALTER TABLE ADD COLUMN for each of the named model columns the database doesn't have yet"""
+    table = model.__table__
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for name in names:
+        if name in existing:
+            continue
+        column_ddl = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+        connection.execute(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}")
+
+
+def applied_versions(connection):
+    schema_version.create(connection, checkfirst=True)
+    return {row.version for row in connection.execute(schema_version.select())}
+
+
+def upgrade(engine=None):
+    """
+    Apply every migration that hasn't been applied yet.
+    Returns the list of (version, description) that were applied.
+    """
+    engine = engine or db.engine
+    applied = []
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+    for version, description, func in MIGRATIONS:
+        if version in done:
+            continue
+        # One transaction per migration so a failure leaves earlier ones recorded
+        with engine.begin() as connection:
+            func(connection)
+            connection.execute(
+                schema_version.insert().values(
+                    version=version, description=description, dateApplied=datetime.datetime.utcnow()
+                )
+            )
+        applied.append((version, description))
+    return applied
+
+
+@migration(1, "Indexes for house scoped queries")
+def add_house_indexes(connection):
+    from uhs12app.models import Membership, Invite, Task, TaskLog, ShamePost, TaskRequest, TaskClaim
+    for model in (Membership, Invite, Task, TaskLog, ShamePost, TaskRequest, TaskClaim):
+        create_missing_indexes(connection, model)
+
+
+@migration(2, "Shame post image variants and processing status")
+def add_shame_post_variants(connection):
+    from uhs12app.models import ShamePost
+    add_missing_columns(connection, ShamePost, "imageHash", "variants", "status")
+
+
+@migration(3, "Outbox for background mail")
+def add_outbox_mail(connection):
+    from uhs12app.models import OutboxMail
+    OutboxMail.__table__.create(connection, checkfirst=True)
+
+
+@migration(4, "House version for the page cache")
+def add_house_version(connection):
+    from uhs12app.models import House
+    add_missing_columns(connection, House, "version")
+
+
+@migration(5, "Task log archive and points rollups")
+def add_tasklog_archive(connection):
+    from uhs12app.models import TaskLogArchive, PointsRollup
+    for model in (TaskLogArchive, PointsRollup):
+        model.__table__.create(connection, checkfirst=True)
+
+
+@migration(6, "Never reuse task log ids")
+def task_log_autoincrement(connection):
+    """
+    TaskLogArchive keeps the ids of the entries it takes, so TaskLog ids must
+    never be handed out again. SQLite only promises that for AUTOINCREMENT
+    tables, which can't be altered into one, so the table is rebuilt.
+    """
+    from uhs12app.models import TaskLog, TaskLogArchive
+    if connection.dialect.name != "sqlite":
+        return
+    table = TaskLog.__table__
+    ddl = connection.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+    ).scalar()
+    if "AUTOINCREMENT" not in ddl.upper():
+        connection.execute(f"ALTER TABLE {table.name} RENAME TO {table.name}_old")
+        # Index names are per database, the old table's have to go before the new ones are made
+        for index in table.indexes:
+            connection.execute(f"DROP INDEX IF EXISTS {index.name}")
+        table.create(connection)
+        columns = ", ".join(f'"{column.name}"' for column in table.columns)
+        connection.execute(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old")
+        connection.execute(f"DROP TABLE {table.name}_old")
+    # Entries may all have been archived already, new ids have to start past those too
+    highest = max(
+        connection.execute(f"SELECT coalesce(max(id), 0) FROM {table.name}").scalar(),
+        connection.execute(f"SELECT coalesce(max(id), 0) FROM {TaskLogArchive.__table__.name}").scalar(),
+    )
+    updated = connection.execute(
+        "UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?", (highest, table.name)
+    ).rowcount
+    if not updated:
+        connection.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table.name, highest))
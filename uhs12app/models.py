@@ -2,17 +2,34 @@
 Models for uhs12
 """
 import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index, and_
+from sqlalchemy.orm import relationship, joinedload
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from flask import current_app
+from flask import current_app, g, has_app_context
 from flask_login import UserMixin
 from uhs12app import db, login_manager
+from uhs12app.users.cache import user_cache
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(int(user_id))
+
+
+def request_memo(key, load):
+    """load(), kept in flask.g so it runs at most once per request"""
+    if not has_app_context():
+        return load()
+    memo = g.setdefault("memo", {})
+    if key not in memo:
+        memo[key] = load()
+    return memo[key]
+
+
+def forget_memberships():
+    """Drop memberships remembered by request_memo, after changing them"""
+    if has_app_context():
+        g.pop("memo", None)
 
 
 class User(db.Model, UserMixin):
@@ -42,7 +59,25 @@ class User(db.Model, UserMixin):
         return s.dumps({User.TOKEN_KEY: self.id}).decode('utf-8')
     
     def active_memberships(self):
-        return [membr for membr in self.memberships if not membr.isExpired]
+        """The user's memberships that haven't expired, oldest first, with their houses"""
+        return request_memo(
+            ("user memberships", self.id),
+            lambda: Membership.query.filter_by(idUser=self.id, isExpired=False)
+            .options(joinedload(Membership.house))
+            .order_by(Membership.id)
+            .all(),
+        )
+
+    def active_house_ids(self):
+        """Ids of the houses the user is an active member of. Cached with the user when logged in"""
+        cached = getattr(self, "cachedActiveHouseIds", None)
+        if cached is not None:
+            return cached
+        return tuple(membr.houseId for membr in self.active_memberships())
+
+    def has_been_member(self, house_id):
+        """True if the user is, or ever was, a member of the house"""
+        return db.session.query(Membership.query.filter_by(idUser=self.id, houseId=house_id).exists()).scalar()
 
 
     @staticmethod
@@ -58,6 +93,11 @@ class User(db.Model, UserMixin):
         return f"User('{self.username}', '{self.email}')"
 
 class Membership(db.Model):
+    __table_args__ = (
+        Index("ix_membership_house_expired", "houseId", "isExpired"),
+        Index("ix_membership_user_expired", "idUser", "isExpired"),
+    )
+
     id = Column(Integer, primary_key=True)
     houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
     idUser = Column(Integer, ForeignKey("user.id"), nullable=False)
@@ -67,6 +107,15 @@ class Membership(db.Model):
     house = relationship("House", backref="house")
     user = relationship("User", backref="user")
 
+    @staticmethod
+    def isActive(user_id, house_id):
+        """
+        SQL condition for the user being a member of the house right now.
+        Writes check this rather than a cached user's activeHouseId, which
+        other workers keep for a while after the user leaves.
+        """
+        return Membership.query.filter_by(idUser=user_id, houseId=house_id, isExpired=False).exists()
+
 
 class House(db.Model):
     id = Column(Integer, primary_key=True)
@@ -74,14 +123,21 @@ class House(db.Model):
     # TODO Make this a foreign key
     adminId = Column(Integer, nullable=False)
     dateCreated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # Bumped whenever anything shown on the house's pages changes, see uhs12app/cache.py
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     members = relationship("Membership", backref="whaat", lazy=True)
     shamePosts = relationship("ShamePost", backref="wtf_is_this", lazy=True)
 
-    def active_memberships(self):
-        return [membr for membr in self.members if not membr.isExpired]
+    def has_active_members(self):
+        return db.session.query(Membership.query.filter_by(houseId=self.id, isExpired=False).exists()).scalar()
 
 
 class Invite(db.Model):
+    __table_args__ = (
+        Index("ix_invite_invited_responded", "idUserInvited", "isResponded"),
+        Index("ix_invite_house_responded", "houseId", "isResponded"),
+    )
+
     id = Column(Integer, primary_key=True)
     houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
     idUserInvited = Column(Integer, ForeignKey("user.id"), nullable=False)
@@ -90,6 +146,10 @@ class Invite(db.Model):
 
 
 class Task(db.Model):
+    __table_args__ = (
+        Index("ix_task_house_expired", "houseId", "isExpired"),
+    )
+
     id = Column(Integer, primary_key=True)
     houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
     name = Column(String(20), nullable=False)
@@ -135,12 +195,47 @@ class Task(db.Model):
     def refreshLastCompleted(self):
         from sqlalchemy import desc
         previousCompletion = TaskLog.query.filter_by(taskId=self.id).order_by(desc("dateCreated")).first()
+        if not previousCompletion:
+            # Completed long enough ago to be archived
+            previousCompletion = TaskLogArchive.query.filter_by(taskId=self.id).order_by(desc("dateCreated")).first()
         if previousCompletion:
-            self.setLastCompleted(previousCompletion.completedBy, previousCompletion.dateCreated)
+            self.setLastCompleted(previousCompletion.user, previousCompletion.dateCreated)
         else:
             self.removeLastCompleted()
 
+    @staticmethod
+    def lastCompletedFromLog(task_id):
+        """
+        Values for an UPDATE that does what refreshLastCompleted does, without
+        loading anything: the newest log entry's date and user, or NULLs
+        """
+        from sqlalchemy import func
+        values = {}
+        for logColumn, taskColumn in (("dateCreated", Task.lastCompletedDate), ("idUser", Task.lastCompletedPersonId)):
+            newest = [
+                model.query.with_entities(getattr(model, logColumn))
+                .filter(model.taskId == task_id)
+                .order_by(model.dateCreated.desc())
+                .limit(1)
+                .as_scalar()
+                for model in (TaskLog, TaskLogArchive)
+            ]
+            # Archived entries are all older, so they only count if there are none left in TaskLog
+            values[taskColumn] = func.coalesce(*newest)
+        return values
+
 class TaskLog(db.Model):
+    __table_args__ = (
+        # /tasklog pages and the leaderboard windows
+        Index("ix_task_log_house_date", "houseId", "dateCreated"),
+        # All time points per user, value included so the sum never reads the table
+        Index("ix_task_log_house_user", "houseId", "idUser", "value"),
+        # Task.refreshLastCompleted
+        Index("ix_task_log_task_date", "taskId", "dateCreated"),
+        # Archived entries keep their ids, so SQLite mustn't hand them out again once TaskLog empties
+        {"sqlite_autoincrement": True},
+    )
+
     id = Column(Integer, primary_key=True)
     houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
     taskId = Column(Integer, ForeignKey("task.id"), nullable=False)
@@ -153,25 +248,56 @@ class TaskLog(db.Model):
     # Record if task was completed during cool off period
     coolOff = Column(Boolean, nullable=False, default=False)
 
-    @staticmethod
-    def pointsByUser(session, user, house_id):
-        # User can be in multiple houses so need to filter by both user and house id
-        tasksByuser = session.query(TaskLog).filter_by(idUser=user.id, houseId=house_id).all()
-        totalPts = sum([task.value for task in tasksByuser])
-        return totalPts
+    # Entries moved to TaskLogArchive say True, so pages showing both can tell them apart
+    isArchived = False
 
-    @classmethod
-    def pointsAllUsers(cls, session, house_id):
-        # TODO how to handle when there's multiple houses per user 
-        all_members = session.query(Membership).filter_by(houseId=house_id, isExpired=False)
-        # allUsers = session.query(User).filter_by(activeHouseId=house_id)
-        ptsByUser = {}  # TODO dict comprehension
-        for member in all_members:
-            ptsByUser[member.user] = cls.pointsByUser(session, member.user, house_id)
-        return ptsByUser
+
+class TaskLogArchive(db.Model):
+    """
+    TaskLog entries older than ARCHIVE_AFTER_DAYS, moved here by `flask archive-tasklog`
+    (see uhs12app/archive.py) with the same ids. Their points are in PointsRollup.
+    """
+    __table_args__ = (
+        Index("ix_task_log_archive_house_date", "houseId", "dateCreated"),
+        Index("ix_task_log_archive_task_date", "taskId", "dateCreated"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
+    taskId = Column(Integer, ForeignKey("task.id"), nullable=False)
+    task = relationship("Task")
+    idUser = Column(Integer, ForeignKey("user.id"), nullable=False)
+    user = relationship("User")
+    dateCreated = Column(DateTime, nullable=False)
+    value = Column(Integer, nullable=False)
+    coolOff = Column(Boolean, nullable=False, default=False)
+    isArchived = True
+
+
+class PointsRollup(db.Model):
+    """Points a user got in a house in a month, from the entries in TaskLogArchive"""
+    __table_args__ = (
+        Index("ix_points_rollup_house_user_period", "houseId", "idUser", "periodStart", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
+    idUser = Column(Integer, ForeignKey("user.id"), nullable=False)
+    # Midnight on the 1st of the month
+    periodStart = Column(DateTime, nullable=False)
+    points = Column(Integer, nullable=False, default=0)
+    entries = Column(Integer, nullable=False, default=0)
 
 
 class ShamePost(db.Model):
+    __table_args__ = (
+        Index("ix_shame_post_house_date", "houseId", "dateCreated"),
+    )
+
+    STATUS_PENDING = "pending"
+    STATUS_READY = "ready"
+    STATUS_FAILED = "failed"
+
     id = Column(Integer, primary_key=True)
     houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
     userId = Column(Integer, ForeignKey("user.id"), nullable=False)
@@ -180,9 +306,53 @@ class ShamePost(db.Model):
     comment = Column(String(140))
     disapprovalCount = Column(Integer, nullable=False, default=0)
     dateCreated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # Uploads are stored as resized variants named after a hash of the upload's content.
+    # Posts from before this have no hash and just the one postImage
+    imageHash = Column(String(64), nullable=True)
+    variants = Column(String(60), nullable=True)
+    status = Column(String(10), nullable=False, default=STATUS_READY, server_default=STATUS_READY)
+
+    def variantImage(self, variant):
+        """File name of a variant of the image, e.g. 'thumb'"""
+        if not self.imageHash or variant not in (self.variants or "").split(","):
+            return self.postImage
+        from uhs12app.main.images import variant_filename
+        return variant_filename(self.imageHash, variant)
+
 
+class ExpiresAfterADay(object):
+    """
+    Requests and claims lapse one day after they are made.
+    Reads work out whether one is still open from dateCreated, so they never
+    have to write. The stored isExpired flag is set when a request is used up,
+    and for lapsed ones in bulk by expireStale (see `flask expire-requests`).
+    """
+    EXPIRY_PERIOD = datetime.timedelta(days=1)
+
+    @classmethod
+    def expiryCutoff(cls, now=None):
+        return (now or datetime.datetime.utcnow()) - cls.EXPIRY_PERIOD
+
+    @classmethod
+    def isOpen(cls, now=None):
+        """SQL condition for a request that is neither used up nor lapsed"""
+        return and_(cls.isExpired == False, cls.dateCreated >= cls.expiryCutoff(now))
+
+    @classmethod
+    def expireStale(cls, session, now=None):
+        """Flag every lapsed row as expired with one UPDATE. Returns the row count"""
+        return (
+            session.query(cls)
+            .filter(cls.isExpired == False, cls.dateCreated < cls.expiryCutoff(now))
+            .update({cls.isExpired: True}, synchronize_session=False)
+        )
+
+
+class TaskRequest(db.Model, ExpiresAfterADay):
+    __table_args__ = (
+        Index("ix_task_request_house_expired", "houseId", "isExpired"),
+    )
 
-class TaskRequest(db.Model):
     id = Column(Integer, primary_key=True)
     houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
     taskId = Column(Integer, ForeignKey("task.id"), nullable=False)
@@ -192,15 +362,12 @@ class TaskRequest(db.Model):
     dateCreated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     isExpired = Column(Boolean, nullable=False, default=False)
 
-    @staticmethod
-    def updateExpired(allTaskRequests):
-        for task in allTaskRequests:
-            # if created + 1 day < now
-            if task.dateCreated + datetime.timedelta(days=1) < datetime.datetime.utcnow():
-                task.isExpired = True
-        return {task for task in allTaskRequests if not task.isExpired}
-
-class TaskClaim(db.Model):
+
+class TaskClaim(db.Model, ExpiresAfterADay):
+    __table_args__ = (
+        Index("ix_task_claim_house_expired", "houseId", "isExpired"),
+    )
+
     id = Column(Integer, primary_key=True)
     houseId = Column(Integer, ForeignKey("house.id"), nullable=False)
     taskId = Column(Integer, ForeignKey("task.id"), nullable=False)
@@ -209,10 +376,30 @@ class TaskClaim(db.Model):
     isExpired = Column(Boolean, nullable=False, default=False)
     userClaimed = relationship("User", backref="taskClaimer")
 
-    @staticmethod
-    def updateExpired(allTaskRequests):
-        # This is dirty. Create some ABC thing or even inheritance
-        return TaskRequest.updateExpired(allTaskRequests)
+class OutboxMail(db.Model):
+    """
+    Email waiting to be sent by the outbox worker, see uhs12app/mailer.py
+    """
+    __table_args__ = (
+        Index("ix_outbox_mail_status_next", "status", "nextAttemptDate"),
+    )
+
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+
+    id = Column(Integer, primary_key=True)
+    subject = Column(String(120), nullable=False)
+    sender = Column(String(120), nullable=False)
+    # Comma separated
+    recipients = Column(String(500), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(10), nullable=False, default=STATUS_PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    nextAttemptDate = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    lastError = Column(String(200), nullable=True)
+    dateCreated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    dateSent = Column(DateTime, nullable=True)
 
 #  Db schema
 # # # # # # # #
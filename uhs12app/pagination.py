@@ -0,0 +1,110 @@
+"""
+Keyset (cursor) pagination for feeds ordered newest first.
+
+Pages are keyed on (dateCreated, id) of the first/last row shown rather than
+a page number, so fetching any page is an index range scan of per_page rows
+no matter how deep it is, and no COUNT(*) is needed to draw the pager.
+"""
+import datetime
+import threading
+import time
+from sqlalchemy import and_, or_
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def encode_cursor(date, row_id):
+    return f"{(date - EPOCH) // MICROSECOND}-{row_id}"
+
+
+def decode_cursor(cursor):
+    """Returns (date, id), or None if the cursor is missing or malformed"""
+    try:
+        micros, row_id = cursor.split("-")
+        return EPOCH + int(micros) * MICROSECOND, int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_rows(query, date_column, id_column, limit, after=None, before=None):
+    """Up to limit rows older than the after cursor, newest first, or newer than before, oldest first"""
+    if before:
+        date, row_id = before
+        query = query.filter(
+            or_(date_column > date, and_(date_column == date, id_column > row_id))
+        ).order_by(date_column.asc(), id_column.asc())
+    else:
+        if after:
+            date, row_id = after
+            query = query.filter(
+                or_(date_column < date, and_(date_column == date, id_column < row_id))
+            )
+        query = query.order_by(date_column.desc(), id_column.desc())
+    return query.limit(limit).all()
+
+
+class KeysetPage(object):
+    """
+    One page of query, newest first.
+    Pass after=<cursor> for the page of older rows following a page, or
+    before=<cursor> for the page of newer rows preceding it.
+    also is more (query, date_column, id_column) to page through as if they
+    were part of query, e.g. an archive table. Ids must be unique across all of them.
+    """
+    def __init__(self, query, date_column, id_column, per_page=20, after=None, before=None, also=()):
+        self.per_page = per_page
+        after = decode_cursor(after)
+        before = decode_cursor(before) if not after else None
+        self._date_attr = date_column.key
+        self._id_attr = id_column.key
+        # One extra row tells us whether there is another page, without counting
+        rows = []
+        for source in ((query, date_column, id_column),) + tuple(also):
+            rows.extend(keyset_rows(*source, per_page + 1, after=after, before=before))
+        if also:
+            rows.sort(key=self._key, reverse=not before)
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if before:
+            rows.reverse()
+            self.has_prev, self.has_next = more, True
+        else:
+            self.has_prev, self.has_next = after is not None, more
+        self.items = rows
+
+    def _key(self, row):
+        return getattr(row, self._date_attr), getattr(row, self._id_attr)
+
+    def _cursor(self, row):
+        return encode_cursor(getattr(row, self._date_attr), getattr(row, self._id_attr))
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.items[-1]) if self.has_next and self.items else None
+
+    @property
+    def prev_cursor(self):
+        return self._cursor(self.items[0]) if self.has_prev and self.items else None
+
+
+class ApproximateCounter(object):
+    """
+    Remembers row counts for a while, so showing a total doesn't mean
+    counting the whole table on every page view.
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, key, query, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+        total = query.order_by(None).count()
+        with self._lock:
+            self._counts[key] = (total, now + (ttl or self.ttl))
+        return total
@@ -0,0 +1,178 @@
+"""
+Production server: the app under waitress in pre-forked worker processes.
+
+The app is created once in the master process, which binds the listening
+socket and forks the workers, so each worker starts with everything already
+imported and set up. Each worker runs waitress with its own threads on the
+shared socket.
+
+Signals to the master:
+    SIGHUP           start a fresh set of workers, then gracefully stop the old ones
+    SIGTERM/SIGINT   gracefully stop the workers and exit
+
+A worker stopping gracefully stops accepting connections and exits once its
+open connections are done, or after graceful_timeout seconds. New workers
+are forked from the master, so SIGHUP recycles workers but doesn't load new
+code; restart the master for a deploy.
+
+The master runs even for a single worker, so SIGHUP always restarts rather
+than stops. Only where os.fork isn't available (Windows) is the app served
+from this process, without a master and so without SIGHUP restarts.
+"""
+import os
+import signal
+import socket
+import time
+from uhs12app import db
+
+MASTER_SIGNALS = (signal.SIGTERM, signal.SIGINT) + ((signal.SIGHUP,) if hasattr(signal, "SIGHUP") else ())
+
+
+def bind_socket(host, port, backlog=1024):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def run_worker(app, sock, graceful_timeout, forked=False, **waitress_options):
+    """Serve on sock until SIGTERM, then finish open connections and return"""
+    from waitress.server import create_server
+    from waitress.channel import HTTPChannel
+
+    # Don't share database connections with the master or other workers
+    with app.app_context():
+        db.engine.dispose()
+    server = create_server(app, sockets=[sock], **waitress_options)
+    deadline = []
+
+    def stop(signum, frame):
+        if not deadline:
+            deadline.append(time.monotonic() + graceful_timeout)
+            # Stop accepting. Only closes this process's copy of the socket
+            server.accepting = False
+            server.close()
+
+    for signum in MASTER_SIGNALS:
+        # A forked worker leaves everything but SIGTERM to the master, e.g. Ctrl-C in the terminal
+        signal.signal(signum, signal.SIG_IGN if forked else stop)
+    signal.signal(signal.SIGTERM, stop)
+    while True:
+        server.asyncore.loop(timeout=1, map=server._map, use_poll=True, count=1)
+        if deadline:
+            open_channels = [channel for channel in server._map.values() if isinstance(channel, HTTPChannel)]
+            if not open_channels or time.monotonic() > deadline[0]:
+                break
+    server.task_dispatcher.shutdown()
+
+
+class Master(object):
+    """Forks and watches the worker processes"""
+
+    def __init__(self, app, sock, processes, graceful_timeout, waitress_options):
+        self.app = app
+        self.sock = sock
+        self.processes = processes
+        self.graceful_timeout = graceful_timeout
+        self.waitress_options = waitress_options
+        self.workers = set()
+        self.pending_signals = []
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+        status = 0
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            run_worker(self.app, self.sock, self.graceful_timeout, forked=True, **self.waitress_options)
+        except BaseException:
+            self.app.logger.exception("Worker %s crashed", os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def stop_workers(self, workers):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        """Collect exited workers. Returns how many exited"""
+        exited = 0
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
+            if pid in self.workers:
+                self.workers.discard(pid)
+                exited += 1
+        return exited
+
+    def run(self):
+        for signum in MASTER_SIGNALS:
+            signal.signal(signum, lambda signum, frame: self.pending_signals.append(signum))
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        for _ in range(self.processes):
+            self.spawn()
+        print(f"Serving on {self.sock.getsockname()} with {self.processes} workers, master pid {os.getpid()}")
+        retiring = set()
+        while True:
+            time.sleep(0.5)
+            self.reap()
+            retiring &= self.workers
+            while self.pending_signals:
+                signum = self.pending_signals.pop(0)
+                if signum == getattr(signal, "SIGHUP", None):
+                    # Bring up the new workers before the old ones stop accepting
+                    retiring |= self.workers
+                    self.workers = set()
+                    for _ in range(self.processes):
+                        self.spawn()
+                    self.stop_workers(retiring)
+                    self.workers |= retiring
+                else:
+                    return self.shutdown()
+            # Replace workers that died, but not ones being retired
+            for _ in range(self.processes - len(self.workers - retiring)):
+                self.spawn()
+
+    def shutdown(self):
+        self.stop_workers(self.workers)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            time.sleep(0.2)
+            self.reap()
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.sock.close()
+
+
+def serve(app, host="0.0.0.0", port=5000, processes=1, threads=8, connection_limit=100,
+          keep_alive=120, graceful_timeout=30):
+    """
+    Serve the app until stopped.
+    keep_alive is how many seconds an idle connection is kept open.
+    """
+    waitress_options = dict(
+        threads=threads,
+        connection_limit=connection_limit,
+        channel_timeout=keep_alive,
+        ident="uhs12",
+    )
+    sock = bind_socket(host, port)
+    if not hasattr(os, "fork"):
+        print(f"Serving on {sock.getsockname()} with {threads} threads")
+        run_worker(app, sock, graceful_timeout, **waitress_options)
+        return
+    Master(app, sock, max(processes, 1), graceful_timeout, waitress_options).run()
@@ -0,0 +1,119 @@
+"""
+Sidecar serving the live update streams with aiohttp.
+
+An open stream in the main app holds a worker thread, so the app only
+allows a few per worker. The sidecar holds any number of them on one event
+loop, and reads the version of every watched house in a single query every
+SSE_SIDECAR_POLL seconds, however many subscribers there are.
+
+    python run.py events --port 5001
+
+then set SSE_SIDECAR_URL (UHS_SSE_SIDECAR_URL) to where browsers can reach
+it, and the home page subscribes there with a token signed by the app
+(see uhs12app/events.py).
+"""
+import asyncio
+from sqlalchemy import select
+from uhs12app import db
+from uhs12app.events import CHANGED, format_event, verify_sidecar_token
+
+
+class Sidecar(object):
+    def __init__(self, app):
+        self.app = app
+        self.poll_interval = app.config["SSE_SIDECAR_POLL"]
+        # house id -> set of queues, one per stream
+        self.houses = {}
+        self.versions = {}
+
+    def read_versions(self, house_ids):
+        from uhs12app.models import House
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                rows = connection.execute(select([House.id, House.version]).where(House.id.in_(house_ids)))
+                return dict(rows.fetchall())
+
+    async def poll(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            house_ids = list(self.houses)
+            if not house_ids:
+                continue
+            try:
+                versions = await loop.run_in_executor(None, self.read_versions, house_ids)
+            except Exception:
+                self.app.logger.exception("Reading house versions failed")
+                continue
+            for house_id, version in versions.items():
+                if self.versions.get(house_id) == version:
+                    continue
+                self.versions[house_id] = version
+                for changes in self.houses.get(house_id, ()):
+                    # One waiting "changed" is as good as several
+                    if changes.empty():
+                        changes.put_nowait(version)
+
+    async def stream(self, request):
+        from aiohttp import web
+
+        house_id = int(request.match_info["house_id"])
+        if verify_sidecar_token(self.app, request.query.get("token", "")) != house_id:
+            raise web.HTTPForbidden()
+        if house_id not in self.versions:
+            versions = await asyncio.get_event_loop().run_in_executor(None, self.read_versions, [house_id])
+            if house_id not in versions:
+                raise web.HTTPNotFound()
+            self.versions[house_id] = versions[house_id]
+        version = self.versions[house_id]
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+                # The token is the credential, so any page may hold the stream open
+                "Access-Control-Allow-Origin": "*",
+            }
+        )
+        await response.prepare(request)
+        changes = asyncio.Queue(maxsize=1)
+        self.houses.setdefault(house_id, set()).add(changes)
+        try:
+            await response.write(("retry: 3000\n" + format_event(event_id=version)).encode("utf-8"))
+            last_seen = request.headers.get("Last-Event-ID")
+            if last_seen is not None and last_seen != str(version):
+                await response.write(format_event({"type": CHANGED}, event_id=version).encode("utf-8"))
+            while True:
+                try:
+                    version = await asyncio.wait_for(changes.get(), timeout=30)
+                    message = format_event({"type": CHANGED}, event_id=version)
+                except asyncio.TimeoutError:
+                    message = format_event(comment="ping")
+                await response.write(message.encode("utf-8"))
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            subscribers = self.houses.get(house_id, set())
+            subscribers.discard(changes)
+            if not subscribers:
+                self.houses.pop(house_id, None)
+                self.versions.pop(house_id, None)
+        return response
+
+
+def serve_events(app, host="0.0.0.0", port=5001):
+    from aiohttp import web
+
+    sidecar = Sidecar(app)
+    web_app = web.Application()
+    web_app.router.add_get("/houses/{house_id:\\d+}/events", sidecar.stream)
+
+    async def start_polling(web_app):
+        web_app["poller"] = asyncio.ensure_future(sidecar.poll())
+
+    async def stop_polling(web_app):
+        web_app["poller"].cancel()
+
+    web_app.on_startup.append(start_polling)
+    web_app.on_cleanup.append(stop_polling)
+    web.run_app(web_app, host=host, port=port)
@@ -0,0 +1,146 @@
+"""
+Things a user can do to a task, shared by the HTML routes and the JSON api.
+None of these commit, so several can be applied in one transaction.
+Everything is checked before anything is changed, so an action that raises
+ActionError leaves the session as it was.
+
+Completing and deleting are guarded so that repeating one, e.g. a double tap
+on the Complete link, changes nothing the second time. Completing checks the
+task's lastCompletedDate is still what the user saw (`seen`) in the same
+UPDATE that sets it, so only one of two racing completions gets through.
+seen is required, so links from before it existed can't log twice either.
+"""
+import datetime
+from uhs12app import db
+from uhs12app.cache import bump_house_version
+from uhs12app.events import house_event
+from uhs12app.models import Membership, Task, TaskLog, TaskRequest, TaskClaim
+
+NEVER = "never"
+
+
+class ActionError(Exception):
+    """The action can't be applied, the message says why"""
+
+
+def seen_token(date):
+    """How a page records the lastCompletedDate it showed, for parse_seen"""
+    return date.isoformat() if date else NEVER
+
+
+def parse_seen(token):
+    """The lastCompletedDate from seen_token, None if never completed"""
+    if token is None:
+        raise ActionError("That link is out of date, reload the task list and try again")
+    if token == NEVER:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(token)
+    except (TypeError, ValueError):
+        raise ActionError("seen must be an iso date, or never")
+
+
+def house_task(user, task_id):
+    """An unexpired task in the user's active house, which they are still a member of"""
+    task = Task.query.filter(
+        Task.id == task_id,
+        Task.houseId == user.activeHouseId,
+        Task.isExpired == False,
+        Membership.isActive(user.id, user.activeHouseId),
+    ).first()
+    if not task:
+        raise ActionError(f"No task {task_id} in your house")
+    return task
+
+
+def request_task(user, task_id):
+    task = house_task(user, task_id)
+    newRequest = TaskRequest(houseId=user.activeHouseId, taskId=task.id, userId=user.id)
+    db.session.add(newRequest)
+    db.session.flush()
+    bump_house_version(user.activeHouseId)
+    house_event(user.activeHouseId, "requested", taskId=task.id, requestId=newRequest.id, userId=user.id)
+    return task, newRequest
+
+
+def claim_task(user, task_id):
+    task = house_task(user, task_id)
+    newClaim = TaskClaim(houseId=user.activeHouseId, taskId=task.id, userId=user.id)
+    db.session.add(newClaim)
+    db.session.flush()
+    bump_house_version(user.activeHouseId)
+    house_event(user.activeHouseId, "claimed", taskId=task.id, claimId=newClaim.id, userId=user.id)
+    return task, newClaim
+
+
+def complete_task(user, task_id, seen, request_id=None, claim_id=None):
+    """
+    Log the task as completed by the user, using up the open request and claim given.
+    seen is the task's lastCompletedDate as the user last saw it, the completion
+    is refused if it has changed since
+    """
+    task = house_task(user, task_id)
+    otherClaims = TaskClaim.query.filter(
+        TaskClaim.taskId == task.id, TaskClaim.isOpen(), TaskClaim.userId != user.id
+    )
+    # You can't complete a task that is claimed by another user
+    if db.session.query(otherClaims.exists()).scalar():
+        raise ActionError(f"'{task.name}' is claimed by someone else")
+    now = datetime.datetime.utcnow()
+    value = task.currentValue()
+    coolOff = task.isCooloffActive()
+    completing = Task.query.filter(
+        Task.id == task.id,
+        Task.isExpired == False,
+        Task.lastCompletedDate == seen if seen else Task.lastCompletedDate.is_(None),
+    )
+    # Setting lastCompletedDate is the guard, it only matches if no one got there first
+    updated = completing.update(
+        {Task.lastCompletedDate: now, Task.lastCompletedPersonId: user.id, Task.isExpired: task.isOnceOff},
+        synchronize_session=False,
+    )
+    if not updated:
+        raise ActionError(f"'{task.name}' has already been completed")
+    if claim_id:
+        TaskClaim.query.filter_by(id=claim_id, taskId=task.id, isExpired=False).update(
+            {TaskClaim.isExpired: True}, synchronize_session=False
+        )
+    if request_id:
+        TaskRequest.query.filter_by(id=request_id, taskId=task.id, isExpired=False).update(
+            {TaskRequest.isExpired: True}, synchronize_session=False
+        )
+    taskItem = TaskLog(
+        houseId=user.activeHouseId, taskId=task.id, idUser=user.id, value=value, coolOff=coolOff, dateCreated=now
+    )
+    db.session.add(taskItem)
+    db.session.flush()
+    bump_house_version(user.activeHouseId)
+    house_event(
+        user.activeHouseId, "completed", taskId=task.id, logId=taskItem.id, userId=user.id, value=taskItem.value
+    )
+    return task, taskItem
+
+
+def delete_log_entry(user, log_id):
+    """Delete a completed task from the house's log, putting the task's last completion back"""
+    taskLogItem = (
+        TaskLog.query.join(TaskLog.task)
+        .with_entities(TaskLog.id, TaskLog.taskId, TaskLog.dateCreated, Task.name)
+        .filter(
+            TaskLog.id == log_id,
+            TaskLog.houseId == user.activeHouseId,
+            Membership.isActive(user.id, user.activeHouseId),
+        )
+        .first()
+    )
+    if not taskLogItem:
+        raise ActionError("That task isn't in your house's log, it may have been deleted already")
+    if not TaskLog.query.filter_by(id=taskLogItem.id).delete(synchronize_session=False):
+        raise ActionError("That task has already been deleted")
+    # Only needs updating if this was the task's last completion
+    Task.query.filter_by(id=taskLogItem.taskId, lastCompletedDate=taskLogItem.dateCreated).update(
+        Task.lastCompletedFromLog(taskLogItem.taskId), synchronize_session=False
+    )
+    bump_house_version(user.activeHouseId)
+    house_event(user.activeHouseId, "deleted", taskId=taskLogItem.taskId, logId=taskLogItem.id)
+    return taskLogItem.name
@@ -0,0 +1,94 @@
+"""
+Task board on the home screen.
+Everything the template needs is loaded up front and resolved into plain
+TaskCard records, so rendering never goes back to the database.
+"""
+from sqlalchemy.orm import joinedload
+from uhs12app.models import Task, TaskRequest, TaskClaim
+from uhs12app.tasks.actions import seen_token
+
+
+class TaskCard(object):
+    """State of one task on the board, as seen by one user"""
+    __slots__ = (
+        "id",
+        "name",
+        "description",
+        "value",
+        "coolOffValue",
+        "isOnceOff",
+        "isCooloffActive",
+        "coolOffEnding",
+        "lastCompletedDate",
+        "lastCompletedByName",
+        "requestId",
+        "requesterId",
+        "claimId",
+        "claimerId",
+        "userRequested",
+        "userClaimed",
+        "otherUserClaimed",
+    )
+
+    def __init__(self, task, task_request, task_claim, user_id):
+        self.id = task.id
+        self.name = task.name
+        self.description = task.description
+        self.value = task.value
+        self.coolOffValue = task.coolOffValue
+        self.isOnceOff = task.isOnceOff
+        self.coolOffEnding = task.whenCoolOffEnding()
+        self.isCooloffActive = self.coolOffEnding is not None
+        self.lastCompletedDate = task.lastCompletedDate
+        self.lastCompletedByName = task.lastCompletedBy.username if task.lastCompletedBy else None
+        self.requestId = task_request.id if task_request else None
+        self.requesterId = task_request.userId if task_request else None
+        self.claimId = task_claim.id if task_claim else None
+        self.claimerId = task_claim.userId if task_claim else None
+        self.userRequested = self.requesterId is not None and self.requesterId == user_id
+        self.userClaimed = self.claimerId is not None and self.claimerId == user_id
+        # You can't complete a task that is claimed by another user
+        self.otherUserClaimed = self.claimerId is not None and self.claimerId != user_id
+
+    @property
+    def seen(self):
+        """For the Complete link, see tasks/actions.py"""
+        return seen_token(self.lastCompletedDate)
+
+    @property
+    def state(self):
+        """Everything the card shows, the key for its cached fragment"""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @property
+    def currentValue(self):
+        return self.coolOffValue if self.isCooloffActive else self.value
+
+    def as_dict(self):
+        """The card for the json api, dates in iso format"""
+        card = {name: getattr(self, name) for name in self.__slots__}
+        card["currentValue"] = self.currentValue
+        card["seen"] = self.seen
+        for name in ("coolOffEnding", "lastCompletedDate"):
+            if card[name] is not None:
+                card[name] = card[name].isoformat()
+        return card
+
+
+class TaskBoardInfo(object):
+    """Info about the taskboard on the home screen"""
+    def __init__(self, house_id, user_id):
+        allTasks = (
+            Task.query.options(joinedload(Task.lastCompletedBy))
+            .filter_by(houseId=house_id, isExpired=False)
+            .order_by(Task.id)
+            .all()
+        )
+        allTaskRequests = TaskRequest.query.filter(TaskRequest.houseId == house_id, TaskRequest.isOpen()).all()
+        allTaskClaims = TaskClaim.query.filter(TaskClaim.houseId == house_id, TaskClaim.isOpen()).all()
+        # Store in dict for easy lookups
+        requests = {taskReq.taskId: taskReq for taskReq in allTaskRequests}
+        claims = {taskClaim.taskId: taskClaim for taskClaim in allTaskClaims}
+        cards = [TaskCard(task, requests.get(task.id), claims.get(task.id), user_id) for task in allTasks]
+        # Sort the tasks with an open request and no claim first
+        self.allTasks = sorted(cards, key=lambda card: card.requestId is not None and card.claimId is None, reverse=True)
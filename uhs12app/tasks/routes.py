@@ -1,86 +1,56 @@
-from flask import render_template, url_for, flash, redirect, request
+from flask import render_template, url_for, flash, redirect, request, current_app
 from flask_login import current_user, login_required
 from uhs12app import db, bcrypt, mail
 from uhs12app.tasks.forms import (
     NewTaskForm,
 )
-from uhs12app.models import User, House, Invite, Task, TaskLog, ShamePost, TaskRequest, TaskClaim
+from uhs12app.models import (
+    User, House, Invite, Membership, Task, TaskLog, TaskLogArchive, ShamePost, TaskRequest, TaskClaim
+)
+from uhs12app.tasks.board import TaskBoardInfo
+from uhs12app.tasks.actions import (
+    ActionError,
+    parse_seen,
+    request_task,
+    claim_task,
+    complete_task,
+    delete_log_entry,
+)
+from uhs12app.pagination import ApproximateCounter
+from uhs12app.archive import log_page
+from uhs12app.cache import cached_house_page, bump_house_version
+from uhs12app.events import house_event, events_url
 from flask import Blueprint
 
 tasks = Blueprint('tasks', __name__)
-
-class TaskBoardInfo(object):
-    """Info about the taskboard on the home screen"""
-    def __init__(self, house_id):
-        allTasks = Task.query.filter_by(houseId=house_id, isExpired=False)
-        # Sort the tasks with an open request first 
-        allTaskRequests = TaskRequest.query.filter_by(houseId=house_id, isExpired=False).all()
-        allTaskClaims = TaskClaim.query.filter_by(houseId=house_id, isExpired=False).all()
-        allTaskRequests = TaskRequest.updateExpired(allTaskRequests)
-        allTaskClaims = TaskRequest.updateExpired(allTaskClaims)
-        # Check if any tasks or claims are expired. Store in dict for easy lookups 
-        self.allTaskRequests = {taskReq.taskId: taskReq for taskReq in allTaskRequests}
-        self.allTaskClaims = {taskClaim.taskId: taskClaim for taskClaim in allTaskClaims}
-        self.allTasks = sorted(allTasks, key=lambda x : self.allTaskRequests.get(x.id) is not None and self.allTaskClaims.get(x.id) is None, reverse=True)
-
-    def request_id(self, task):
-        return self.allTaskRequests.get(task.id).id if self.allTaskRequests.get(task.id) else None
-
-    # ID of an open claim made on the task
-    def claim_id(self, task):
-        return self.allTaskClaims.get(task.id).id if self.allTaskClaims.get(task.id) else None
-
-    # ID of the user who has an open claim on the task
-    def claimer_id(self, task):
-        return self.allTaskClaims.get(task.id).userClaimed.id if self.allTaskClaims.get(task.id) else None
-
-    # Return true if the given user has an open claim on the task 
-    def has_user_claimed(self, user, task):
-        return user.id == self.claimer_id(task)
-
-    # ID of the user who has an open request on the task 
-    def requester_id(self, task):
-        return self.allTaskRequests.get(task.id).userId if self.allTaskRequests.get(task.id) else None
-    
-    # Return true if the given user has an open request on the task 
-    def has_user_requested(self, user, task):
-        return user.id == self.requester_id(task)
-    
-    def has_other_user_claimed(self, user, task):
-        # False if there's no open claim
-        if not self.claim_id(task):
-            return False
-        # False if this user has a claim
-        if self.claimer_id(task) == user.id:
-            return False
-        # Another user must have an open claim 
-        return True
+tasklog_counter = ApproximateCounter()
 
 @tasks.route("/")
 @tasks.route("/home", methods=["GET", "POST"])
 @login_required
+@cached_house_page
 def home():
     """
     The home page will contain your list of tasks
     """
     if not current_user.activeHouseId:
         return redirect(url_for("house.whathouse"))
-    task_info = TaskBoardInfo(current_user.activeHouseId)
-    db.session.commit()    # TODO is this commit needed? To update expired?
-    return render_template("home.html", task_info=task_info, curr_user=current_user)
+    task_info = TaskBoardInfo(current_user.activeHouseId, current_user.id)
+    return render_template(
+        "home.html",
+        task_info=task_info,
+        events_url=events_url(current_app, current_user.activeHouseId, current_user.id),
+    )
 
 
 @tasks.route("/taskrequest", methods=["GET", "POST"])
 @login_required
 def taskrequest():
-    # Create a request
-    taskRequested = Task.query.filter_by(id=int(request.args["taskid"])).first()
-    newRequest = TaskRequest(
-        houseId=current_user.activeHouseId,
-        taskId=taskRequested.id,
-        userId=current_user.id,
-    )
-    db.session.add(newRequest)
+    try:
+        taskRequested, _ = request_task(current_user, int(request.args["taskid"]))
+    except ActionError as error:
+        flash(str(error), "warning")
+        return redirect(url_for("tasks.home"))
     db.session.commit()
     flash(f"You've made a request for task '{taskRequested.name}'!", "success")
     return redirect(url_for("tasks.home"))
@@ -89,14 +59,11 @@ def taskrequest():
 @tasks.route("/taskclaim", methods=["GET", "POST"])
 @login_required
 def taskclaim():
-    taskClaimed = Task.query.filter_by(id=int(request.args["taskid"])).first()
-    # Create a claim 
-    newClaim = TaskClaim(
-        houseId=current_user.activeHouseId,
-        taskId=taskClaimed.id,
-        userId=current_user.id,
-    )
-    db.session.add(newClaim)
+    try:
+        taskClaimed, _ = claim_task(current_user, int(request.args["taskid"]))
+    except ActionError as error:
+        flash(str(error), "warning")
+        return redirect(url_for("tasks.home"))
     db.session.commit()
     flash(f"Great! You've claimed '{taskClaimed.name}' for 1 day", "success")
     return redirect(url_for("tasks.home"))
@@ -112,6 +79,9 @@ def newtask():
         return redirect(url_for("house.whathouse"))
     taskForm = NewTaskForm()
     if taskForm.validate_on_submit():
+        if not db.session.query(Membership.isActive(current_user.id, current_user.activeHouseId)).scalar():
+            flash("You're no longer a member of that house", "warning")
+            return redirect(url_for("house.whathouse"))
         task = Task(
             houseId=current_user.activeHouseId,
             name=taskForm.name.data,
@@ -122,6 +92,9 @@ def newtask():
             isOnceOff=is_once_off if is_once_off else False,
         )
         db.session.add(task)
+        db.session.flush()
+        bump_house_version(current_user.activeHouseId)
+        house_event(current_user.activeHouseId, "created", taskId=task.id)
         db.session.commit()
         flash(f"Task '{taskForm.name.data}' created!", "success")
         return redirect(url_for("tasks.home"))
@@ -131,42 +104,36 @@ def newtask():
 
 @tasks.route("/tasklog")
 @login_required
+@cached_house_page
 def tasklog():
     if not current_user.activeHouseId:
         return redirect(url_for("house.whathouse"))
-    page_num = request.args.get('page', 1, type=int)
-    allTasksCompleted = TaskLog.query.order_by(TaskLog.dateCreated.desc()).filter_by(houseId=current_user.activeHouseId).paginate(per_page=20, page=page_num)
+    houseId = current_user.activeHouseId
+    allTasksCompleted = log_page(houseId, after=request.args.get("after"), before=request.args.get("before"))
+    approx_total = None
+    if current_app.config.get("TASKLOG_APPROX_TOTAL"):
+        ttl = current_app.config.get("TASKLOG_COUNT_TTL")
+        approx_total = tasklog_counter.count(
+            houseId, TaskLog.query.filter_by(houseId=houseId), ttl
+        ) + tasklog_counter.count(("archived", houseId), TaskLogArchive.query.filter_by(houseId=houseId), ttl)
     return render_template(
-        "tasklog.html", tasklog=allTasksCompleted, currUser=current_user
+        "tasklog.html", tasklog=allTasksCompleted, currUser=current_user, approx_total=approx_total
     )
 
 @tasks.route("/taskcomplete", methods=["GET", "POST"])
 @login_required
 def taskcomplete():
-    if request.args.get("claimid"):
-        # TODO isExpired filter is pointless here, how could we get here with an expired one? 
-        # TODO this should only ever be one item, ensure this is correct
-        claims = TaskClaim.query.filter_by(id=int(request.args["claimid"]), isExpired=False).all()
-        for claim in claims: 
-            claim.isExpired = True
-    if request.args.get("requestid"):
-        taskRequests = TaskRequest.query.filter_by(id=int(request.args["requestid"]), isExpired=False).all()
-        for taskReq in taskRequests: 
-            taskReq.isExpired = True
-    taskCompleted = Task.query.filter_by(id=int(request.args["taskid"])).first()
-    if taskCompleted.isOnceOff:
-        taskCompleted.isExpired = True
-    # TODO if last completed date is with cool off window, value is cool off value
-    taskItem = TaskLog(
-        houseId=current_user.activeHouseId,
-        taskId=taskCompleted.id,
-        idUser=current_user.id,
-        value=taskCompleted.currentValue(),
-        coolOff=taskCompleted.isCooloffActive(),
-    )
-    db.session.add(taskItem)
-    db.session.commit()
-    taskCompleted.setLastCompleted(current_user, taskItem.dateCreated)
+    try:
+        taskCompleted, _ = complete_task(
+            current_user,
+            int(request.args["taskid"]),
+            parse_seen(request.args.get("seen")),
+            request_id=request.args.get("requestid", type=int),
+            claim_id=request.args.get("claimid", type=int),
+        )
+    except ActionError as error:
+        flash(str(error), "warning")
+        return redirect(url_for("tasks.home"))
     flash(f"Great work! You completed task '{taskCompleted.name}'", "success")
     db.session.commit()
     return redirect(url_for("tasks.home"))
@@ -175,15 +142,11 @@ def taskcomplete():
 @tasks.route("/taskdelete", methods=["GET", "POST"])
 @login_required
 def taskdelete():
-    taskLogItem = TaskLog.query.filter_by(id=int(request.args["taskid"])).first()
-    nameDeleted = taskLogItem.task.name
-    db.session.delete(taskLogItem)
-    # Update last completed time of task
-    # If date doesn't match, doesn't need updating
-    task = Task.query.filter_by(id=taskLogItem.taskId).first()
-    if task.lastCompletedDate == taskLogItem.dateCreated:
-        task.refreshLastCompleted()
+    try:
+        nameDeleted = delete_log_entry(current_user, int(request.args["taskid"]))
+    except ActionError as error:
+        flash(str(error), "warning")
+        return redirect(url_for("tasks.tasklog"))
     db.session.commit()
     flash(f"You deleted task '{nameDeleted}'", "info")
     return redirect(url_for("tasks.tasklog"))
-
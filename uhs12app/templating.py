@@ -0,0 +1,71 @@
+"""
+Jinja setup: a bytecode cache on disk, and a {% cache %} tag for fragments.
+
+Compiled templates are written to JINJA_BYTECODE_CACHE_DIR (or Jinja's own
+directory under the system temp dir), so a restarted worker loads them instead
+of compiling every template again. Entries are keyed on a checksum of the
+template source, so a deploy with changed templates recompiles just those.
+`flask compile-templates` fills the cache ahead of the first requests.
+
+{% cache %} keeps the rendered body for a key made of its arguments:
+
+    {% cache "task", task.state %}
+        ...
+    {% endcache %}
+
+The key must hold everything the body shows, e.g. a card's row id and the
+state it is drawn from, since nothing else invalidates an entry. Fragments are
+kept per worker in an LRU of FRAGMENT_CACHE_SIZE entries, 0 to turn it off.
+"""
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from uhs12app.cache import LRUCache
+
+fragment_cache = LRUCache()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=fragment_cache)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        # Keys from different templates never collide
+        key = [nodes.Const(parser.name)]
+        key.append(parser.parse_expression())
+        while parser.stream.skip_if("comma"):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(self.call_method("_render", [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = tuple(key)
+        body = cache.get(key)
+        if body is None:
+            body = caller()
+            cache.set(key, body)
+        return body
+
+
+def init_templating(app):
+    env = app.jinja_env
+    env.add_extension(FragmentCacheExtension)
+    size = app.config["FRAGMENT_CACHE_SIZE"]
+    fragment_cache.maxsize = size
+    env.fragment_cache = fragment_cache if size else None
+    if app.config["JINJA_BYTECODE_CACHE"]:
+        env.bytecode_cache = FileSystemBytecodeCache(app.config["JINJA_BYTECODE_CACHE_DIR"])
+
+
+def compile_templates(app):
+    """Load every template once, so their bytecode is cached. Returns how many there are"""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
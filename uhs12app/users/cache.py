@@ -0,0 +1,62 @@
+"""
+Cache of logged in users, so authenticating a request doesn't need a query.
+
+Flask-Login calls load_user on every request. Instead of querying the User
+row each time, its column values are kept for USER_CACHE_TTL seconds, along
+with the ids of the houses the user is an active member of, and the user is
+attached to the request's session without going to the database.
+
+Routes that change a user's row or memberships must call
+user_cache.invalidate(user_id) so this worker reloads it. Other workers
+pick the change up when their copy expires, so keep the TTL short.
+"""
+import threading
+import time
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from uhs12app import db
+
+
+class UserCache(object):
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        """The User for the id, attached to the current session, or None"""
+        from uhs12app.models import User, Membership
+        ttl = current_app.config.get("USER_CACHE_TTL", 0)
+        if not ttl:
+            return User.query.get(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry and entry[0] > now:
+            _, values, house_ids = entry
+            cached = User(**values)
+            make_transient_to_detached(cached)
+            user = db.session.merge(cached, load=False)
+        else:
+            user = User.query.get(user_id)
+            if user is None:
+                return None
+            values = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+            house_ids = tuple(
+                houseId for houseId, in db.session.query(Membership.houseId).filter_by(idUser=user_id, isExpired=False)
+            )
+            with self._lock:
+                self._entries[user_id] = (now + ttl, values, house_ids)
+        user.cachedActiveHouseIds = house_ids
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
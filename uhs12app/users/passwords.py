@@ -0,0 +1,69 @@
+"""
+Password hashing on a small, bounded pool of threads.
+
+bcrypt is deliberately slow. Run directly in the views, a burst of logins
+keeps every web thread busy hashing and the rest of the site stalls. Here
+hashes run on PASSWORD_HASH_WORKERS threads (bcrypt releases the GIL), and
+once PASSWORD_HASH_QUEUE are waiting a request waits up to PASSWORD_HASH_WAIT
+seconds for a slot before ExecutorBusy is raised, which is served as a 503.
+
+The cost is BCRYPT_LOG_ROUNDS. Stored hashes made with a different cost are
+rehashed the next time their owner logs in.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from uhs12app import bcrypt
+from uhs12app.executors import BoundedExecutor
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def password_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            executor = ThreadPoolExecutor(
+                max_workers=current_app.config["PASSWORD_HASH_WORKERS"], thread_name_prefix="bcrypt"
+            )
+            _pool = BoundedExecutor(executor, current_app.config["PASSWORD_HASH_QUEUE"])
+        return _pool
+
+
+def _run(fn, *args):
+    future = password_pool().submit(fn, *args, wait=current_app.config["PASSWORD_HASH_WAIT"])
+    return future.result()
+
+
+def hash_password(password):
+    """bcrypt hash of the password at the configured cost, as a str"""
+    rounds = current_app.config["BCRYPT_LOG_ROUNDS"]
+    return _run(bcrypt.generate_password_hash, password, rounds).decode("utf-8")
+
+
+def check_password(user, password):
+    """False for a wrong password, and for a stored value that isn't a bcrypt hash at all"""
+    try:
+        return _run(bcrypt.check_password_hash, user.password, password)
+    except ValueError:
+        return False
+
+
+def hash_rounds(pw_hash):
+    """Cost factor a bcrypt hash was made with, e.g. 12 for $2b$12$..."""
+    try:
+        return int(pw_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def rehash_if_needed(user, password):
+    """
+    Rehash a just verified password if it was stored with a different cost.
+    Returns True if user.password was changed and needs committing.
+    """
+    if hash_rounds(user.password) == current_app.config["BCRYPT_LOG_ROUNDS"]:
+        return False
+    user.password = hash_password(password)
+    return True
@@ -1,10 +1,7 @@
-import os
-import secrets
-from datetime import datetime
-from PIL import Image
-from flask import render_template, url_for, flash, redirect, request, current_app
+from flask import render_template, url_for, flash, redirect, request, current_app, abort
 from flask_login import login_user, current_user, logout_user, login_required
-from uhs12app import db, bcrypt, mail
+from uhs12app import db
+from uhs12app.mailer import queue_mail
 from uhs12app.users.forms import (
     RegistrationForm,
     LoginForm,
@@ -12,7 +9,8 @@ from uhs12app.users.forms import (
     ResetPasswordForm,
 )
 from uhs12app.models import User, House, Invite, Task, TaskLog, ShamePost
-from flask_mail import Message
+from uhs12app.users.cache import user_cache
+from uhs12app.users.passwords import hash_password, check_password, rehash_if_needed
 from flask import Blueprint
 
 users = Blueprint('users', __name__)
@@ -31,9 +29,12 @@ def profile():
 @login_required
 def setactive():
     """Set which house is your active house"""
-    house_id = request.args.get("houseid")
+    house_id = request.args.get("houseid", type=int)
+    if house_id not in current_user.active_house_ids():
+        abort(403)
     current_user.activeHouseId = house_id
     db.session.commit()
+    user_cache.invalidate(current_user.id)
     return redirect(url_for("users.profile"))
 
 
@@ -44,7 +45,10 @@ def login():
     login_form = LoginForm()
     if login_form.validate_on_submit():
         user = User.query.filter(User.email.ilike(login_form.email.data)).first()
-        if user and bcrypt.check_password_hash(user.password, login_form.password.data):
+        if user and check_password(user, login_form.password.data):
+            if rehash_if_needed(user, login_form.password.data):
+                db.session.commit()
+                user_cache.invalidate(user.id)
             login_user(user, remember=login_form.remember.data)
             if user.activeHouseId:
                 return redirect(url_for("tasks.home"))
@@ -62,7 +66,7 @@ def signup():
         return redirect(url_for("tasks.home"))
     regForm = RegistrationForm()
     if regForm.validate_on_submit():
-        hashedPw = bcrypt.generate_password_hash(regForm.password.data).decode("utf-8")
+        hashedPw = hash_password(regForm.password.data)
         user = User(
             username=regForm.username.data, email=regForm.email.data, password=hashedPw
         )
@@ -78,21 +82,23 @@ def signup():
 
 @users.route("/logout")
 def logout():
+    if current_user.is_authenticated:
+        user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for("tasks.home"))
 
 
 def send_reset_email(user):
     token = user.get_reset_token()
-    # msg = Message('Password Reset Request', sender='noreply@demo.com', recipients=[user.email])
-    msg = Message('Password Reset Request', sender=current_app.config['MAIL_USERNAME'], recipients=[user.email])
-    msg.body = f"""
+    body = f"""
     To reset your password, visit the following link: 
     {url_for('users.reset_token', token=token, _external=True)}
     
     If you did not request a password reset then please ignore this email. 
     """
-    mail.send(msg)
+    # Sent by the outbox worker, the request doesn't wait on the mail server
+    queue_mail('Password Reset Request', current_app.config['MAIL_USERNAME'], [user.email], body)
+    db.session.commit()
 
 @users.route("/reset_password", methods=["GET", "POST"])
 def reset_request():
@@ -123,9 +129,10 @@ def reset_token(token):
         return redirect(url_for('users.reset_request'))
     pwForm = ResetPasswordForm()
     if pwForm.validate_on_submit():
-        hashedPw = bcrypt.generate_password_hash(pwForm.password.data).decode("utf-8")
+        hashedPw = hash_password(pwForm.password.data)
         user.password = hashedPw
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash(
             f"Your password has been updated! You can now log in", "success",
         )